@@ -0,0 +1,485 @@
+/*
+ * Optional C accelerator for pytrie.
+ *
+ * It implements the key lookup loop of pytrie.Trie: _find(), __contains__()
+ * and __getitem__(). The nodes remain instances of pytrie.Node and their
+ * slots are read in place through the offsets of the slot descriptors, which
+ * are registered by pytrie with init(). Nodes of other types are accessed
+ * through regular attribute lookups, and children mappings that are not dicts
+ * through their get method, so any NodeFactory keeps working.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <structmember.h>
+
+/* Without the GIL (free-threaded builds) the slots of the nodes are accessed
+ * through their descriptors and the cache of wide characters is disabled, so
+ * that no shared state is read or written unsynchronized. */
+#ifdef Py_GIL_DISABLED
+#define WITH_GIL 0
+#else
+#define WITH_GIL 1
+#endif
+
+static PyTypeObject *node_type = NULL;
+static Py_ssize_t value_offset, children_offset;
+static PyObject *null = NULL;
+
+static PyObject *str_root, *str_value, *str_children, *str_get;
+
+/* Strings of one character, the key parts of str keys: the latin-1 ones are
+ * created once, the rest are cached by their code point modulo the size of
+ * wide_chars. */
+static PyObject *latin1_chars[256];
+#define WIDE_CHARS 1024
+static PyObject *wide_chars[WIDE_CHARS];
+
+#define SLOT(node, offset) (*(PyObject **)((char *)(node) + (offset)))
+
+/* Return a new reference to the attribute ``name`` of ``node``. */
+static PyObject *
+node_get(PyObject *node, Py_ssize_t offset, PyObject *name)
+{
+    PyObject *attr;
+
+    if (!WITH_GIL || !PyObject_TypeCheck(node, node_type))
+        return PyObject_GetAttr(node, name);
+    attr = SLOT(node, offset);
+    if (attr == NULL) {
+        PyErr_SetObject(PyExc_AttributeError, name);
+        return NULL;
+    }
+    Py_INCREF(attr);
+    return attr;
+}
+
+/* Look up ``key`` in the dict ``dict`` as PyDict_GetItemRef() does: return 1
+ * and store a new reference in ``result`` if it exists, 0 if it doesn't and
+ * -1 on error. */
+static int
+dict_get(PyObject *dict, PyObject *key, PyObject **result)
+{
+#if PY_VERSION_HEX >= 0x030D0000
+    return PyDict_GetItemRef(dict, key, result);
+#else
+    *result = PyDict_GetItemWithError(dict, key);
+    if (*result == NULL)
+        return PyErr_Occurred() ? -1 : 0;
+    Py_INCREF(*result);
+    return 1;
+#endif
+}
+
+/* Look up the child of ``node`` for ``part``.
+ *
+ * Return 1 and store a new reference in ``child`` if it exists, 0 if it
+ * doesn't and -1 on error.
+ */
+static int
+get_child(PyObject *node, PyObject *part, PyObject **child)
+{
+    PyObject *children, *result;
+    int found;
+
+    if (WITH_GIL && Py_IS_TYPE(node, node_type)) {
+        /* fast path: the slot is read once and the dict is not type
+         * checked again */
+        children = SLOT(node, children_offset);
+        if (children != NULL && PyDict_CheckExact(children)) {
+            Py_INCREF(children);
+            found = dict_get(children, part, child);
+            Py_DECREF(children);
+            return found;
+        }
+    }
+    children = node_get(node, children_offset, str_children);
+    if (children == NULL)
+        return -1;
+    if (PyDict_Check(children)) {
+        found = dict_get(children, part, child);
+        Py_DECREF(children);
+        return found;
+    }
+    result = PyObject_CallMethodOneArg(children, str_get, part);
+    Py_DECREF(children);
+    if (result == NULL)
+        return -1;
+    if (result == Py_None) {
+        Py_DECREF(result);
+        return 0;
+    }
+    *child = result;
+    return 1;
+}
+
+/* Iteration over the parts of a key, with fast paths for str, tuple and
+ * list keys. */
+typedef struct {
+    PyObject *key;
+    PyObject *iterator;
+    Py_ssize_t index;
+    /* the length, kind and data of str keys */
+    Py_ssize_t length;
+    int kind;
+    const void *data;
+} KeyParts;
+
+#define KEY_PARTS_INIT {NULL, NULL, 0, 0, 0, NULL}
+
+static int
+key_parts_init(KeyParts *parts, PyObject *key)
+{
+    parts->key = key;
+    parts->index = 0;
+    parts->iterator = NULL;
+    if (PyUnicode_CheckExact(key)) {
+        parts->length = PyUnicode_GET_LENGTH(key);
+        parts->kind = PyUnicode_KIND(key);
+        parts->data = PyUnicode_DATA(key);
+        return 0;
+    }
+    if (PyTuple_CheckExact(key) || PyList_CheckExact(key))
+        return 0;
+    parts->iterator = PyObject_GetIter(key);
+    return parts->iterator == NULL ? -1 : 0;
+}
+
+/* Return a new reference to the string of the character ``ch``. */
+static PyObject *
+char_string(Py_UCS4 ch)
+{
+    PyObject *string;
+
+    if (ch < 256) {
+        string = latin1_chars[ch];
+        Py_INCREF(string);
+        return string;
+    }
+    if (!WITH_GIL)
+        return PyUnicode_FromOrdinal(ch);
+    string = wide_chars[ch % WIDE_CHARS];
+    if (string == NULL || PyUnicode_READ_CHAR(string, 0) != ch) {
+        string = PyUnicode_FromOrdinal(ch);
+        if (string == NULL)
+            return NULL;
+        Py_XSETREF(wide_chars[ch % WIDE_CHARS], string);
+    }
+    Py_INCREF(string);
+    return string;
+}
+
+/* Return a new reference to the next part, or NULL when the parts are
+ * exhausted or on error. */
+static PyObject *
+key_parts_next(KeyParts *parts)
+{
+    PyObject *key = parts->key, *part;
+
+    if (parts->data != NULL) {
+        if (parts->index >= parts->length)
+            return NULL;
+        return char_string(PyUnicode_READ(parts->kind, parts->data,
+                                          parts->index++));
+    }
+    if (parts->iterator != NULL)
+        return PyIter_Next(parts->iterator);
+    if (PyTuple_CheckExact(key)) {
+        if (parts->index >= PyTuple_GET_SIZE(key))
+            return NULL;
+        part = PyTuple_GET_ITEM(key, parts->index++);
+    }
+    else {
+        if (parts->index >= PyList_GET_SIZE(key))
+            return NULL;
+        part = PyList_GET_ITEM(key, parts->index++);
+    }
+    Py_INCREF(part);
+    return part;
+}
+
+static void
+key_parts_clear(KeyParts *parts)
+{
+    Py_CLEAR(parts->iterator);
+}
+
+/* The fast path of the walk down the trie: advance ``*node`` (a new
+ * reference) along the characters of a latin-1 str key from the current
+ * part of ``parts``, for as long as the nodes are of the node type with dict
+ * children. The slots and the characters are read in place and the key parts
+ * are the cached one-character strings.
+ *
+ * Return 1 if the walk fell off the trie, 0 if the rest of the parts (if any)
+ * must be walked by the generic path and -1 on error.
+ */
+static int
+walk_latin1(PyObject **node, KeyParts *parts)
+{
+    const Py_UCS1 *chars = parts->data;
+    PyObject *children, *child;
+
+    if (!WITH_GIL || chars == NULL || parts->kind != PyUnicode_1BYTE_KIND)
+        return 0;
+    while (parts->index < parts->length && Py_IS_TYPE(*node, node_type)) {
+        children = SLOT(*node, children_offset);
+        if (children == NULL || !PyDict_CheckExact(children))
+            return 0;
+        /* comparing the keys of the dict may run arbitrary code */
+        Py_INCREF(children);
+        child = PyDict_GetItemWithError(
+            children, latin1_chars[chars[parts->index]]);
+        Py_XINCREF(child);
+        Py_DECREF(children);
+        if (child == NULL)
+            return PyErr_Occurred() ? -1 : 1;
+        parts->index++;
+        Py_SETREF(*node, child);
+    }
+    return 0;
+}
+
+static int
+check_initialized(void)
+{
+    if (node_type == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "_pytrie.init() was not called");
+        return -1;
+    }
+    return 0;
+}
+
+/* Return a new reference to the node of ``key`` in ``trie``, or to None. */
+static PyObject *
+find_node(PyObject *trie, PyObject *key)
+{
+    PyObject *node, *part, *child = NULL;
+    KeyParts parts = KEY_PARTS_INIT;
+    int found;
+
+    if (check_initialized() < 0)
+        return NULL;
+    node = PyObject_GetAttr(trie, str_root);
+    if (node == NULL)
+        return NULL;
+    if (key_parts_init(&parts, key) < 0) {
+        Py_DECREF(node);
+        return NULL;
+    }
+    found = walk_latin1(&node, &parts);
+    if (found != 0) {
+        Py_DECREF(node);
+        key_parts_clear(&parts);
+        if (found < 0)
+            return NULL;
+        Py_RETURN_NONE;
+    }
+    while ((part = key_parts_next(&parts)) != NULL) {
+        found = get_child(node, part, &child);
+        Py_DECREF(part);
+        Py_DECREF(node);
+        if (found <= 0) {
+            key_parts_clear(&parts);
+            if (found < 0)
+                return NULL;
+            Py_RETURN_NONE;
+        }
+        node = child;
+    }
+    key_parts_clear(&parts);
+    if (PyErr_Occurred()) {
+        Py_DECREF(node);
+        return NULL;
+    }
+    return node;
+}
+
+/* Return a new reference to the value of ``key`` in ``trie``, or to NULL. */
+static PyObject *
+find_value(PyObject *trie, PyObject *key)
+{
+    PyObject *node, *value;
+
+    node = find_node(trie, key);
+    if (node == NULL)
+        return NULL;
+    if (node == Py_None) {
+        Py_DECREF(node);
+        Py_INCREF(null);
+        return null;
+    }
+    value = node_get(node, value_offset, str_value);
+    Py_DECREF(node);
+    return value;
+}
+
+static int
+check_nargs(const char *name, Py_ssize_t nargs, Py_ssize_t expected)
+{
+    if (nargs != expected) {
+        PyErr_Format(PyExc_TypeError,
+                     "%s() takes exactly %zd argument%s (%zd given)",
+                     name, expected, expected == 1 ? "" : "s", nargs);
+        return -1;
+    }
+    return 0;
+}
+
+PyDoc_STRVAR(find_doc, "_find(self, key)\n--\n\n");
+
+static PyObject *
+trie_find(PyObject *self, PyObject *const *args, Py_ssize_t nargs)
+{
+    if (check_nargs("_find", nargs, 1) < 0)
+        return NULL;
+    return find_node(self, args[0]);
+}
+
+PyDoc_STRVAR(contains_doc, "__contains__(self, key)\n--\n\n");
+
+static PyObject *
+trie_contains(PyObject *self, PyObject *const *args, Py_ssize_t nargs)
+{
+    PyObject *value;
+    int contains;
+
+    if (check_nargs("__contains__", nargs, 1) < 0)
+        return NULL;
+    value = find_value(self, args[0]);
+    if (value == NULL)
+        return NULL;
+    contains = value != null;
+    Py_DECREF(value);
+    return PyBool_FromLong(contains);
+}
+
+PyDoc_STRVAR(getitem_doc, "__getitem__(self, key)\n--\n\n");
+
+static PyObject *
+trie_getitem(PyObject *self, PyObject *const *args, Py_ssize_t nargs)
+{
+    PyObject *value;
+
+    if (check_nargs("__getitem__", nargs, 1) < 0)
+        return NULL;
+    value = find_value(self, args[0]);
+    if (value == null) {
+        Py_DECREF(value);
+        PyErr_SetNone(PyExc_KeyError);
+        return NULL;
+    }
+    return value;
+}
+
+static int
+slot_offset(PyObject *type, const char *name, Py_ssize_t *offset)
+{
+    PyObject *descr;
+    PyMemberDef *member;
+
+    descr = PyObject_GetAttrString(type, name);
+    if (descr == NULL)
+        return -1;
+    if (!PyObject_TypeCheck(descr, &PyMemberDescr_Type)) {
+        PyErr_Format(PyExc_TypeError, "%R.%s is not a slot", type, name);
+        Py_DECREF(descr);
+        return -1;
+    }
+    member = ((PyMemberDescrObject *)descr)->d_member;
+    if (member->type != T_OBJECT_EX) {
+        PyErr_Format(PyExc_TypeError, "%R.%s is not an object slot", type,
+                     name);
+        Py_DECREF(descr);
+        return -1;
+    }
+    *offset = member->offset;
+    Py_DECREF(descr);
+    return 0;
+}
+
+PyDoc_STRVAR(init_doc,
+"init(node_type, null)\n--\n\n"
+"Register the node class whose slots are accessed directly and the\n"
+"sentinel for missing values.\n");
+
+static PyObject *
+init(PyObject *module, PyObject *args)
+{
+    PyObject *type, *null_sentinel;
+
+    if (!PyArg_ParseTuple(args, "O!O:init", &PyType_Type, &type,
+                          &null_sentinel))
+        return NULL;
+    if (slot_offset(type, "value", &value_offset) < 0 ||
+        slot_offset(type, "children", &children_offset) < 0)
+        return NULL;
+    Py_INCREF(type);
+    Py_XSETREF(node_type, (PyTypeObject *)type);
+    Py_INCREF(null_sentinel);
+    Py_XSETREF(null, null_sentinel);
+    Py_RETURN_NONE;
+}
+
+#define FASTCALL(func) ((PyCFunction)(void(*)(void))(func))
+
+/* Functions exported as method descriptors, to be bound to pytrie.Trie. */
+static PyMethodDef trie_methods[] = {
+    {"_find", FASTCALL(trie_find), METH_FASTCALL, find_doc},
+    {"__contains__", FASTCALL(trie_contains), METH_FASTCALL, contains_doc},
+    {"__getitem__", FASTCALL(trie_getitem), METH_FASTCALL, getitem_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyMethodDef module_methods[] = {
+    {"init", init, METH_VARARGS, init_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef module_def = {
+    PyModuleDef_HEAD_INIT,
+    "_pytrie",
+    "C accelerator for pytrie.",
+    -1,
+    module_methods,
+};
+
+PyMODINIT_FUNC
+PyInit__pytrie(void)
+{
+    PyObject *module, *method;
+    PyMethodDef *def;
+    Py_UCS4 ch;
+
+    module = PyModule_Create(&module_def);
+    if (module == NULL)
+        return NULL;
+#ifdef Py_GIL_DISABLED
+    PyUnstable_Module_SetGIL(module, Py_MOD_GIL_NOT_USED);
+#endif
+#define INTERN(var, name) \
+    if ((var = PyUnicode_InternFromString(name)) == NULL) goto error;
+    INTERN(str_root, "_root");
+    INTERN(str_value, "value");
+    INTERN(str_children, "children");
+    INTERN(str_get, "get");
+#undef INTERN
+    for (ch = 0; ch < 256; ch++) {
+        if ((latin1_chars[ch] = PyUnicode_FromOrdinal(ch)) == NULL)
+            goto error;
+    }
+    for (def = trie_methods; def->ml_name != NULL; def++) {
+        /* descriptors of ``object`` accept any instance as ``self`` */
+        method = PyDescr_NewMethod(&PyBaseObject_Type, def);
+        if (method == NULL)
+            goto error;
+        if (PyModule_AddObject(module, def->ml_name, method) < 0) {
+            Py_DECREF(method);
+            goto error;
+        }
+    }
+    return module;
+
+error:
+    Py_DECREF(module);
+    return NULL;
+}
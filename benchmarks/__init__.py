@@ -0,0 +1,11 @@
+"""Benchmarks for pytrie.
+
+Run the whole suite with::
+
+    python -m benchmarks
+
+and ``python -m benchmarks --help`` for the options that select corpora,
+trie classes and operations. The corpora are synthetic and generated from a
+fixed seed, so runs of different releases or variants are comparable; use
+``--json`` to save the results for such comparisons.
+"""
@@ -0,0 +1,98 @@
+"""Command line interface of the benchmarks: ``python -m benchmarks``."""
+
+import argparse
+import json
+import platform
+import sys
+from importlib import metadata
+
+import pytrie
+
+from . import corpora, suite
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Benchmark pytrie tries on synthetic key corpora. Times '
+                    'are per key, or per query for the prefix operations.')
+    parser.add_argument('-n', '--size', type=int, default=5000,
+                        help='number of keys per corpus (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs per operation; the best one is reported '
+                             '(default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the corpora (default: %(default)s)')
+    parser.add_argument('-c', '--corpora', nargs='+', metavar='CORPUS',
+                        choices=list(corpora.CORPORA),
+                        default=list(corpora.CORPORA),
+                        help='one or more of: %s' % ', '.join(corpora.CORPORA))
+    parser.add_argument('-t', '--classes', nargs='+', metavar='CLASS',
+                        choices=list(suite.CLASSES),
+                        default=suite.DEFAULT_CLASSES,
+                        help='one or more of: %s (default: %s)' % (
+                            ', '.join(suite.CLASSES),
+                            ', '.join(suite.DEFAULT_CLASSES)))
+    parser.add_argument('-o', '--operations', nargs='+', metavar='OPERATION',
+                        choices=list(suite.OPERATIONS),
+                        default=list(suite.OPERATIONS),
+                        help='one or more of: %s' % ', '.join(suite.OPERATIONS))
+    parser.add_argument('--json', metavar='PATH',
+                        help='also write the results as JSON to PATH')
+    return parser.parse_args(argv)
+
+
+def format_table(operations, classes, results):
+    rows = [('us/op',) + tuple(classes)]
+    for name in operations:
+        rows.append((name,) + tuple(
+            '-' if results[cls][name] is None
+            else '%.2f' % (results[cls][name] * 1e6) for cls in classes))
+    for name in 'peak_bytes_per_key', 'retained_bytes_per_key':
+        rows.append((name.replace('_per_key', '/key').replace('_', ' '),) +
+                    tuple('%.0f' % results[cls][name] for cls in classes))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return '\n'.join(
+        '  '.join([row[0].ljust(widths[0])] +
+                  [cell.rjust(width) for cell, width in zip(row[1:],
+                                                            widths[1:])])
+        for row in rows)
+
+
+def pytrie_version():
+    try:
+        return metadata.version('PyTrie')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = {
+        'pytrie': pytrie_version(),
+        'accelerated': pytrie._pytrie is not None,  # pylint: disable=protected-access
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'size': args.size,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': {},
+    }
+    print('pytrie %(pytrie)s (C accelerator: %(accelerated)s), '
+          '%(implementation)s %(python)s' % report)
+    for corpus in args.corpora:
+        keys = corpora.generate(corpus, args.size, args.seed)
+        results = report['results'][corpus] = {}
+        for cls in args.classes:
+            results[cls] = suite.run(keys, suite.CLASSES[cls], args.operations,
+                                     args.repeat)
+        print('\n%s corpus, %d keys' % (corpus, args.size))
+        print(format_table(args.operations, args.classes, results))
+        sys.stdout.flush()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Synthetic, reproducible key corpora."""
+
+import random
+import string
+
+_SYLLABLES = [c + v for c in 'bcdfghklmnprstvz' for v in 'aeiou']
+_SUFFIXES = ['', '', '', 's', 'ed', 'ing', 'er', 'ly', 'ness', 'tion']
+_SEGMENTS = ['api', 'v1', 'v2', 'users', 'items', 'search', 'static', 'img',
+             'css', 'js', 'blog', 'posts', 'tags', 'admin', 'docs', 'help']
+
+
+def random_strings(size, rng):
+    """Random lowercase strings of 4 to 16 characters."""
+    letters = string.ascii_lowercase
+    return [''.join(rng.choice(letters) for _ in range(rng.randint(4, 16)))
+            for _ in range(size)]
+
+
+def words(size, rng):
+    """Pronounceable dictionary-like words that share stems and suffixes."""
+    stems = [''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(1, 4)))
+             for _ in range(max(size // 3, 1))]
+    return [rng.choice(stems) + rng.choice(_SUFFIXES) for _ in range(size)]
+
+
+def urls(size, rng):
+    """URL-like paths with long shared prefixes."""
+    hosts = ['https://%s.example.%s' % (rng.choice(_SEGMENTS),
+                                        rng.choice(['com', 'org', 'net']))
+             for _ in range(8)]
+    keys = []
+    for _ in range(size):
+        path = [rng.choice(_SEGMENTS) for _ in range(rng.randint(1, 4))]
+        path.append(str(rng.randrange(10000)))
+        keys.append(rng.choice(hosts) + '/' + '/'.join(path))
+    return keys
+
+
+def ip_prefixes(size, rng):
+    """IPv4 network prefixes of 8 to 32 bits, as tuples of bits."""
+    keys = []
+    for _ in range(size):
+        address = rng.getrandbits(32)
+        length = rng.choice([8, 16, 20, 24, 24, 24, 28, 32])
+        keys.append(tuple((address >> (31 - i)) & 1 for i in range(length)))
+    return keys
+
+
+CORPORA = {
+    'random': random_strings,
+    'words': words,
+    'urls': urls,
+    'ip': ip_prefixes,
+}
+
+
+def generate(name, size, seed=0):
+    """Return ``size`` distinct keys of the corpus ``name``, in random order.
+
+    The keys depend only on ``name``, ``size`` and ``seed``.
+    """
+    rng = random.Random(seed)
+    factory = CORPORA[name]
+    keys = dict.fromkeys(factory(size, rng))
+    while len(keys) < size:
+        keys.update(dict.fromkeys(factory(size - len(keys), rng)))
+    keys = list(keys)[:size]
+    rng.shuffle(keys)
+    return keys
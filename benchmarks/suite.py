@@ -0,0 +1,191 @@
+"""Benchmark operations and the code that measures them."""
+
+import gc
+import pickle
+import time
+import tracemalloc
+from collections import deque
+
+import pytrie
+
+#: The trie classes that can be benchmarked, by name.
+CLASSES = {name: getattr(pytrie, name) for name in [
+    'Trie', 'StringTrie', 'SortedTrie', 'SortedStringTrie',
+    'ScoredTrie', 'ScoredStringTrie', 'CompressedTrie', 'CompressedStringTrie',
+    'FrozenTrie',
+]}
+
+#: The classes benchmarked by default.
+DEFAULT_CLASSES = ['Trie', 'StringTrie', 'SortedTrie', 'SortedStringTrie']
+
+_MAX_QUERIES = 200
+
+
+class Workload:
+    """The keys and queries of a corpus, adapted to a trie class."""
+
+    def __init__(self, cls, keys):
+        if cls.KeyFactory is not tuple and keys and \
+                not isinstance(keys[0], str):
+            # string tries join their key parts, so spell out bit tuples
+            keys = [''.join(map(str, key)) for key in keys]
+        self.cls = cls
+        self.keys = keys
+        self.items = [(key, i) for i, key in enumerate(keys)]
+        sample = keys[:_MAX_QUERIES]
+        #: prefixes of the keys, for the subtree queries
+        self.prefixes = [key[:len(key) * 3 // 4] for key in sample]
+        #: extensions of the keys, for the prefix queries
+        self.extensions = [key + key[:3] for key in sample]
+
+    def build(self):
+        return self.cls(self.items)
+
+
+def _consume(iterable):
+    deque(iterable, maxlen=0)
+
+
+# Each operation takes a workload and a trie with its items and returns the
+# number of operations performed, so that times are reported per operation.
+
+def _insert(workload, trie):
+    trie = workload.cls()
+    for key, value in workload.items:
+        trie[key] = value
+    return len(workload.items)
+
+
+def _construct(workload, trie):
+    workload.build()
+    return len(workload.items)
+
+
+def _getitem(workload, trie):
+    for key in workload.keys:
+        trie[key]  # pylint: disable=pointless-statement
+    return len(workload.keys)
+
+
+def _keys_prefix(workload, trie):
+    for prefix in workload.prefixes:
+        trie.keys(prefix=prefix)
+    return len(workload.prefixes)
+
+
+def _prefix_method(name, consume=False):
+    def operation(workload, trie):
+        method = getattr(trie, name)
+        if consume:
+            for key in workload.extensions:
+                _consume(method(key))
+        else:
+            for key in workload.extensions:
+                method(key, default=None)
+        return len(workload.extensions)
+    operation.__name__ = name
+    return operation
+
+
+def _delitem(workload, trie):
+    for key in workload.keys:
+        del trie[key]
+    return len(workload.keys)
+
+
+def _copy(workload, trie):
+    trie.copy()
+    return len(workload.keys)
+
+
+def _pickle(workload, trie):
+    pickle.loads(pickle.dumps(trie, pickle.HIGHEST_PROTOCOL))
+    return len(workload.keys)
+
+
+class Operation:
+    """A benchmarked operation.
+
+    :param run: Callable that performs the operation given a
+        :class:`Workload` and a trie, and returns the number of operations it
+        performed.
+    :param mutates: Whether ``run`` modifies the trie, in which case every run
+        is given a fresh copy.
+    :param requires: Name of the method that the trie class must have to
+        support the operation.
+    """
+
+    def __init__(self, run, mutates=False, requires=None):
+        self.run = run
+        self.mutates = mutates
+        self.requires = requires
+
+    def supports(self, cls):
+        return self.requires is None or hasattr(cls, self.requires)
+
+
+OPERATIONS = {
+    'insert': Operation(_insert, requires='__setitem__'),
+    'construct': Operation(_construct),
+    'getitem': Operation(_getitem),
+    'keys(prefix)': Operation(_keys_prefix),
+    'longest_prefix': Operation(_prefix_method('longest_prefix')),
+    'longest_prefix_value': Operation(_prefix_method('longest_prefix_value')),
+    'longest_prefix_item': Operation(_prefix_method('longest_prefix_item')),
+    'iter_prefixes': Operation(_prefix_method('iter_prefixes', True)),
+    'iter_prefix_values': Operation(_prefix_method('iter_prefix_values',
+                                                   True)),
+    'iter_prefix_items': Operation(_prefix_method('iter_prefix_items', True)),
+    'delitem': Operation(_delitem, mutates=True, requires='__delitem__'),
+    'copy': Operation(_copy, requires='copy'),
+    'pickle': Operation(_pickle),
+}
+
+
+def time_operation(operation, workload, trie, repeat):
+    """Return the best time per operation of ``repeat`` runs, in seconds, or
+    None if ``operation`` doesn't support the trie class."""
+    if not operation.supports(workload.cls):
+        return None
+    best = float('inf')
+    for _ in range(repeat):
+        target = trie.copy() if operation.mutates else trie
+        gc.collect()
+        start = time.perf_counter()
+        count = operation.run(workload, target)
+        best = min(best, (time.perf_counter() - start) / count)
+    return best
+
+
+def measure_memory(workload):
+    """Return the peak and the retained memory allocated while building a
+    trie of the workload, in bytes per key."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        trie = workload.build()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del trie
+    size = len(workload.keys)
+    return peak / size, retained / size
+
+
+def run(keys, cls, operations, repeat=3):
+    """Benchmark ``operations`` of ``cls`` with ``keys``.
+
+    :return: A dict from operation names to seconds per operation (None for
+        unsupported operations), plus ``peak_bytes_per_key`` and
+        ``retained_bytes_per_key``.
+    """
+    workload = Workload(cls, keys)
+    trie = workload.build()
+    results = {}
+    for name in operations:
+        results[name] = time_operation(OPERATIONS[name], workload, trie,
+                                       repeat)
+    del trie
+    results['peak_bytes_per_key'], results['retained_bytes_per_key'] = \
+        measure_memory(workload)
+    return results
@@ -39,15 +39,45 @@ KeyError
 ['all', 'allot']
 >>> list(t.iter_prefix_items('antonym'))
 [('an', 0), ('ant', 1)]
+>>> v = t.view('al')
+>>> len(v), v.keys(start=1, stop=3)
+(4, ['allot', 'alloy'])
 """
 
-__all__ = ['Trie', 'StringTrie', 'SortedTrie', 'SortedStringTrie', 'Node']
-
+__all__ = ['Trie', 'StringTrie', 'SortedTrie', 'SortedStringTrie',
+           'ScoredTrie', 'ScoredStringTrie', 'ConcurrentTrie',
+           'ConcurrentStringTrie', 'PersistentTrie', 'PersistentStringTrie',
+           'CachedTrie', 'CachedStringTrie', 'InstrumentedTrie',
+           'InstrumentedStringTrie',
+           'AlphabetTrie', 'AlphabetStringTrie', 'BytesTrie', 'TrieView',
+           'CompressedTrie', 'CompressedStringTrie', 'SuffixStringTrie',
+           'FrozenTrie', 'MmapTrie', 'IPTrie', 'AhoCorasick', 'Node', 'ANY',
+           'ANY_SEQ']
+
+import ipaddress
+import mmap
+import os
+import pickle
+import struct
 import sys
-from copy import copy
-from collections.abc import MutableMapping
-
-import sortedcontainers
+import threading
+from array import array
+from bisect import bisect_left
+from copy import copy, deepcopy
+from collections import Counter, deque, namedtuple
+from collections.abc import Mapping, MutableMapping
+from functools import lru_cache
+from heapq import heappop, heappush, nlargest
+from itertools import chain, count as counter, islice
+from operator import itemgetter
+
+# Optional C accelerator; set PYTRIE_PURE_PYTHON to disable it
+try:
+    if os.environ.get('PYTRIE_PURE_PYTHON'):
+        raise ImportError('PYTRIE_PURE_PYTHON is set')
+    import _pytrie
+except ImportError:
+    _pytrie = None
 
 
 # Singleton sentinel - works with pickling
@@ -55,6 +85,34 @@ class NULL:
     pass
 
 
+class ANY:
+    """Pattern element of :meth:`Trie.match` that matches any key part."""
+
+
+class ANY_SEQ:
+    """Pattern element of :meth:`Trie.match` that matches any sequence of zero
+    or more key parts."""
+
+
+# File format of MmapTrie: a fixed header followed by 8-byte aligned sections
+_MMAP_MAGIC = b'PYTRIE\x00\x02'
+_MMAP_BYTEORDER = ('%s%d%d%d' % (sys.byteorder[0], array('I').itemsize,
+                                 array('i').itemsize, array('Q').itemsize)
+                  ).encode('ascii').ljust(8, b'\x00')
+_MMAP_HEADER = struct.Struct('<8s8s10Q')
+
+# number of bits set in an int
+_popcount = getattr(int, 'bit_count', None) or (lambda n: bin(n).count('1'))
+
+# result of Trie.stats()
+_TrieStats = namedtuple('TrieStats', 'nodes leaves valueless single_child '
+                                     'depths fanouts memory')
+
+# IP version and number of bits of the address types of IPTrie
+_IP_ADDRESS_TYPES = {ipaddress.IPv4Address: (4, 32),
+                     ipaddress.IPv6Address: (6, 128)}
+
+
 class Node:
     """Trie node class.
 
@@ -64,9 +122,10 @@ class Node:
     :ivar value: The value of the key corresponding to this node or
         :const:`NULL` if there is no such key.
     :ivar children: A ``{key-part : child-node}`` mapping.
+    :ivar count: The number of keys in the subtree rooted at this node.
     """
 
-    __slots__ = ('value', 'children')
+    __slots__ = ('value', 'children', 'count')
 
     #: A callable for creating a new :attr:`children` mapping.
     ChildrenFactory = dict
@@ -74,10 +133,11 @@ class Node:
     def __init__(self, value=NULL):
         self.value = value
         self.children = self.ChildrenFactory()
+        self.count = int(value is not NULL)
 
     def __len__(self):
         """Return the number of keys in the subtree rooted at this node."""
-        return int(self.value is not NULL) + sum(map(len, self.children.values()))
+        return self.count
 
     def __repr__(self):
         return '(%s, {%s})' % (
@@ -86,16 +146,34 @@ class Node:
 
     def __copy__(self):
         clone = self.__class__(self.value)
-        clone_children = clone.children
-        for key, child in self.children.items():
-            clone_children[key] = child.__copy__()
+        clone.count = self.count
+        stack = [(self, clone)]
+        while stack:
+            node, node_clone = stack.pop()
+            clone_children = node_clone.children
+            for part, child in node.children.items():
+                child_clone = child.__class__(child.value)
+                child_clone.count = child.count
+                clone_children[part] = child_clone
+                if child.children:
+                    stack.append((child, child_clone))
         return clone
 
     def __getstate__(self):
-        return self.value, self.children
+        return self.value, self.children, self.count
 
     def __setstate__(self, state):
-        self.value, self.children = state
+        if len(state) == 2:
+            # pickled by a version that did not maintain subtree counts
+            self.value, self.children = state
+            self.count = int(self.value is not NULL) + sum(
+                child.count for child in self.children.values())
+        else:
+            self.value, self.children, self.count = state
+
+
+if _pytrie is not None:
+    _pytrie.init(Node, NULL)
 
 
 class Trie(MutableMapping):
@@ -111,6 +189,10 @@ class Trie(MutableMapping):
     #: Callable for creating new trie nodes.
     NodeFactory = Node
 
+    # whether nodes are never modified once reachable from a root, so that
+    # tries of such classes can share them
+    _shares_nodes = False
+
     def __init__(self, *args, **kwargs):
         """Create a new trie.
 
@@ -128,12 +210,117 @@ class Trie(MutableMapping):
         Parameters are the same with ``dict.fromkeys()``.
         """
         trie = cls()
-        for key in iterable:
-            trie[key] = value
+        trie.update((key, value) for key in iterable)
+        return trie
+
+    @classmethod
+    def from_sorted(cls, items):
+        """Create a new trie from an iterable of ``(key, value)`` items.
+
+        Unless :meth:`__setitem__` is overridden, the items are inserted in a
+        single pass that reuses the path of the previous key, so that the
+        common prefix of consecutive keys is not walked again. This pays off
+        for sorted keys that share long prefixes, such as paths or URLs; for
+        short keys it is no faster than the constructor. Any order is accepted
+        and, as with ``dict``, the last value of a repeated key wins.
+        """
+        trie = cls()
+        if type(trie).__setitem__ is Trie.__setitem__:
+            trie._insert_sorted(items)  # pylint: disable=protected-access
+        else:
+            trie.update(items)
         return trie
 
     #----- trie-specific methods -----------------------------------------------
 
+    def count(self, prefix=None):
+        """Return the number of keys in this trie.
+
+        :param prefix: If not None, count only the keys prefixed by ``prefix``.
+        """
+        if prefix is None:
+            return self._root.count
+        node = self._find(prefix)
+        return node.count if node is not None else 0
+
+    def stats(self):
+        """Return statistics of the structure of this trie.
+
+        The result is a named tuple with the fields:
+          - ``nodes``: the number of nodes, including the root
+          - ``leaves``: the number of nodes without children
+          - ``valueless``: the number of nodes without a value
+          - ``single_child``: the number of nodes with a single child
+          - ``depths``: dict from each depth to the number of nodes at it
+          - ``fanouts``: dict from each number of children to the number of
+            nodes with as many children
+          - ``memory``: the estimated size in bytes of the nodes and their
+            children mappings, excluding the key parts and the values
+        """
+        nodes = leaves = valueless = single_child = memory = 0
+        depths, fanouts = Counter(), Counter()
+        stack = [(self._root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            children = node.children
+            fanout = len(children)
+            nodes += 1
+            if not fanout:
+                leaves += 1
+            elif fanout == 1:
+                single_child += 1
+            if node.value is NULL:
+                valueless += 1
+            depths[depth] += 1
+            fanouts[fanout] += 1
+            memory += sys.getsizeof(node) + sys.getsizeof(children)
+            if fanout:
+                depth += 1
+                stack.extend((child, depth) for child in children.values())
+        return _TrieStats(nodes, leaves, valueless, single_child,
+                          dict(sorted(depths.items())),
+                          dict(sorted(fanouts.items())), memory)
+
+    def view(self, prefix=None):
+        """Return a :class:`TrieView` of the items of this trie whose keys are
+        prefixed by ``prefix``.
+
+        The view shares the nodes of this trie, so creating it takes constant
+        time and it reflects later changes to the trie.
+        """
+        return TrieView(self, prefix)
+
+    def top_k(self, prefix, k, key=None):
+        """Return the ``k`` items prefixed by ``prefix`` with the highest
+        scores, in descending score order.
+
+        :param key: Callable that returns the score of a value; if None, the
+            values are the scores.
+
+        This method looks at every item prefixed by ``prefix``; see
+        :class:`ScoredTrie` for a trie that finds them without doing so.
+        """
+        items = self.iteritems(prefix)
+        if key is None:
+            return nlargest(k, items, key=itemgetter(1))
+        return nlargest(k, items, key=lambda item: key(item[1]))
+
+    def freeze(self):
+        """Return a :class:`FrozenTrie` with the items of this trie."""
+        return FrozenTrie.from_trie(self)
+
+    def save(self, path):
+        """Save this trie to the file ``path``.
+
+        The file can be opened with :meth:`MmapTrie.open`.
+        """
+        self.freeze().save(path)
+
+    def build_automaton(self):
+        """Return an :class:`AhoCorasick` automaton for the items of this
+        trie."""
+        return AhoCorasick.from_trie(self)
+
     def longest_prefix(self, key, default=NULL):
         """Return the longest key in this trie that is a prefix of ``key``.
 
@@ -253,6 +440,243 @@ class Trie(MutableMapping):
             if node.value is not NULL:
                 yield (key_factory(prefix), node.value)
 
+    def search_fuzzy(self, key, max_distance):
+        """Return an iterator over the ``(key, value, distance)`` tuples of the
+        keys of this trie whose Levenshtein distance from ``key`` is at most
+        ``max_distance``.
+
+        The nodes are walked depth first carrying a row of the edit distance
+        matrix, and subtrees whose row exceeds ``max_distance`` everywhere are
+        skipped, so only nodes within the distance bound are visited.
+        """
+        key = list(key)
+        width = len(key) + 1
+        key_factory = self.KeyFactory
+        root = self._root
+        row = list(range(width))
+        if root.value is not NULL and row[-1] <= max_distance:
+            yield (key_factory(()), root.value, row[-1])
+        parts = []
+        stack = [(part, child, row, 0)
+                 for part, child in reversed(list(root.children.items()))]
+        append, pop = stack.append, stack.pop
+        while stack:
+            part, node, above, depth = pop()
+            del parts[depth:]
+            parts.append(part)
+            left = above[0] + 1
+            row = [left]
+            for j in range(1, width):
+                left = min(above[j] + 1, left + 1,
+                           above[j - 1] + (key[j - 1] != part))
+                row.append(left)
+            if node.value is not NULL and left <= max_distance:
+                yield (key_factory(parts), node.value, left)
+            if node.children and min(row) <= max_distance:
+                depth += 1
+                for child_part, child in reversed(list(node.children.items())):
+                    append((child_part, child, row, depth))
+
+    def match(self, pattern):
+        """Return an iterator over the items (``(key,value)`` tuples) of this
+        trie whose keys match ``pattern``.
+
+        ``pattern`` is a sequence whose elements match key parts as follows:
+
+          - :class:`ANY` matches any part
+          - :class:`ANY_SEQ` matches any sequence of zero or more parts
+          - a ``set`` or ``frozenset`` matches any of its members
+          - any other element matches a part equal to it
+
+        Only the branches that can still match are walked.
+        """
+        pattern = list(pattern)
+        end = len(pattern)
+        key_factory = self.KeyFactory
+
+        def closure(positions):
+            # an ANY_SEQ may also match zero parts
+            closed = set()
+            for i in positions:
+                while i < end and pattern[i] is ANY_SEQ:
+                    closed.add(i)
+                    i += 1
+                closed.add(i)
+            return frozenset(closed)
+
+        def step(positions, part):
+            following = []
+            for i in positions:
+                if i == end:
+                    continue
+                element = pattern[i]
+                if element is ANY_SEQ:
+                    following.append(i)
+                elif element is ANY or (part in element if isinstance(
+                        element, (set, frozenset, _PartClass))
+                                        else part == element):
+                    following.append(i + 1)
+            return closure(following)
+
+        def candidates(node, positions):
+            # look up a single literal part instead of scanning the children
+            elements = [pattern[i] for i in positions if i < end]
+            if len(elements) == 1 and elements[0] is not ANY and \
+                    elements[0] is not ANY_SEQ and not isinstance(
+                        elements[0], (set, frozenset, _PartClass)):
+                child = node.children.get(elements[0])
+                return [(elements[0], child)] if child is not None else []
+            return list(node.children.items()) if elements else []
+
+        root = self._root
+        positions = closure([0])
+        if end in positions and root.value is not NULL:
+            yield (key_factory(()), root.value)
+        parts = []
+        stack = [(part, child, positions, 0)
+                 for part, child in reversed(candidates(root, positions))]
+        append, pop = stack.append, stack.pop
+        while stack:
+            part, node, positions, depth = pop()
+            positions = step(positions, part)
+            if not positions:
+                continue
+            del parts[depth:]
+            parts.append(part)
+            if end in positions and node.value is not NULL:
+                yield (key_factory(parts), node.value)
+            if node.children:
+                depth += 1
+                for child_part, child in reversed(candidates(node, positions)):
+                    append((child_part, child, positions, depth))
+
+    #----- batch lookup methods ------------------------------------------------
+
+    def get_many(self, keys, default=None):
+        """Return a list of the values of ``keys``, or ``default`` for the
+        keys that are not in this trie.
+
+        Consecutive keys share the walk of their common prefix, so sorting
+        ``keys`` makes the lookups faster.
+        """
+        result = []
+        append = result.append
+        for found, node, _ in self._walk_many(keys):
+            if found and node.value is not NULL:
+                append(node.value)
+            else:
+                append(default)
+        return result
+
+    def contains_many(self, keys):
+        """Return a list of booleans telling whether each of ``keys`` is in
+        this trie.
+
+        Consecutive keys share the walk of their common prefix, so sorting
+        ``keys`` makes the lookups faster.
+        """
+        return [found and node.value is not NULL
+                for found, node, _ in self._walk_many(keys)]
+
+    def longest_prefix_value_many(self, keys, default=NULL):
+        """Return a list with the :meth:`longest_prefix_value` of each of
+        ``keys``.
+
+        If the trie doesn't contain any prefix of some key:
+          - if ``default`` is given, it is used for that key
+          - otherwise raise ``KeyError``
+
+        Consecutive keys share the walk of their common prefix, so sorting
+        ``keys`` makes the lookups faster.
+        """
+        result = []
+        append = result.append
+        for _, _, value in self._walk_many(keys):
+            if value is not NULL:
+                append(value)
+            elif default is not NULL:
+                append(default)
+            else:
+                raise KeyError
+        return result
+
+    #----- set algebra methods -------------------------------------------------
+
+    def merge(self, other, resolve=None):
+        """Return a new trie with the items of this trie and the mapping
+        ``other``.
+
+        :param resolve: Callable that returns the value of a key in both tries
+            given its value in this trie and in ``other``; if None, the value
+            in ``other`` is used, as in ``dict.update()``.
+        """
+        if resolve is None:
+            def values(value, other_value):
+                return other_value if other_value is not NULL else value
+        else:
+            def values(value, other_value):
+                if value is NULL or other_value is NULL:
+                    return other_value if value is NULL else value
+                return resolve(value, other_value)
+        return self._combine(other, values, True, True,
+                             True if resolve is None else None)
+
+    def intersection(self, other):
+        """Return a new trie with the items of this trie whose keys are also in
+        the mapping ``other``."""
+        def values(value, other_value):
+            return value if other_value is not NULL else NULL
+        return self._combine(other, values, False, False, True)
+
+    def difference(self, other):
+        """Return a new trie with the items of this trie whose keys are not in
+        the mapping ``other``."""
+        def values(value, other_value):
+            return value if other_value is NULL else NULL
+        return self._combine(other, values, True, False, False)
+
+    def diff(self, other):
+        """Return an iterator over the differences between this trie and the
+        mapping ``other``, as ``(key, value, other_value)`` tuples.
+
+        ``value`` is :const:`NULL` for the keys added in ``other`` and
+        ``other_value`` is :const:`NULL` for the keys removed from it; the
+        changed items, with unequal values, are also included.
+        """
+        other = self._as_trie(other)
+        key_factory = self.KeyFactory
+        parts = []
+        # pylint: disable=protected-access
+        stack = [(None, self._root, other._root, None)]
+        while stack:
+            part, node, other_node, depth = stack.pop()
+            if depth is not None:
+                del parts[depth:]
+                parts.append(part)
+            if node is other_node:
+                # a shared subtree has no differences
+                continue
+            if node is None:
+                for key, value in self._iter_node_items(other_node, parts):
+                    yield (key, NULL, value)
+                continue
+            if other_node is None:
+                for key, value in self._iter_node_items(node, parts):
+                    yield (key, value, NULL)
+                continue
+            value, other_value = node.value, other_node.value
+            if value is not other_value and (value is NULL or
+                                             other_value is NULL or
+                                             value != other_value):
+                yield (key_factory(parts), value, other_value)
+            depth = len(parts)
+            children, other_children = node.children, other_node.children
+            for part, other_child in reversed(list(other_children.items())):
+                if part not in children:
+                    stack.append((part, None, other_child, depth))
+            for part, child in reversed(list(children.items())):
+                stack.append((part, child, other_children.get(part), depth))
+
     #----- extended mapping API methods ----------------------------------------
 
      # pylint: disable=arguments-differ
@@ -293,12 +717,20 @@ class Trie(MutableMapping):
         :param prefix: If not None, yield only the values associated with keys
             prefixed by ``prefix``.
         """
-        def generator(node, null=NULL):
-            if node.value is not null:
-                yield node.value
-            for child in node.children.values():
-                for subresult in generator(child):
-                    yield subresult
+        def generator(root, null=NULL):
+            if root.value is not null:
+                yield root.value
+            stack = [iter(root.children.values())]
+            append, pop = stack.append, stack.pop
+            while stack:
+                for child in stack[-1]:
+                    if child.value is not null:
+                        yield child.value
+                    if child.children:
+                        append(iter(child.children.values()))
+                        break
+                else:
+                    pop()
         if prefix is None:
             root = self._root
         else:
@@ -317,15 +749,24 @@ class Trie(MutableMapping):
         append = parts.append
 
         # pylint: disable=dangerous-default-value
-        def generator(node, key_factory=self.KeyFactory, parts=parts,
+        def generator(root, key_factory=self.KeyFactory, parts=parts,
                       append=append, null=NULL):
-            if node.value is not null:
-                yield (key_factory(parts), node.value)
-            for part, child in node.children.items():
-                append(part)
-                for subresult in generator(child):
-                    yield subresult
-                del parts[-1]
+            if root.value is not null:
+                yield (key_factory(parts), root.value)
+            stack = [iter(root.children.items())]
+            while stack:
+                for part, child in stack[-1]:
+                    append(part)
+                    if child.value is not null:
+                        yield (key_factory(parts), child.value)
+                    if child.children:
+                        stack.append(iter(child.children.items()))
+                        break
+                    del parts[-1]
+                else:
+                    stack.pop()
+                    if stack:
+                        del parts[-1]
 
         root = self._root
         if prefix is not None:
@@ -343,10 +784,11 @@ class Trie(MutableMapping):
     #----- original mapping API methods ----------------------------------------
 
     def __len__(self):
-        return len(self._root)
+        return self._root.count
 
     def __bool__(self):
-        return self._root.value is not NULL or bool(self._root.children)
+        root = self._root
+        return root.value is not NULL or bool(root.children)
 
     def __iter__(self):
         return self.iterkeys()
@@ -363,13 +805,29 @@ class Trie(MutableMapping):
 
     def __setitem__(self, key, value):
         node = self._root
-        factory = self.NodeFactory
-        for part in key:
+        path = [node]
+        append = path.append
+        parts = iter(key)
+        for part in parts:
             next_node = node.children.get(part)
             if next_node is None:
+                # the rest of the key is new; its nodes hold just this key
+                factory = self.NodeFactory
                 node = node.children.setdefault(part, factory())
-            else:
-                node = next_node
+                for part in parts:
+                    node.count = 1
+                    next_node = node.children[part] = factory()
+                    node = next_node
+                node.count = 1
+                break
+            node = next_node
+            append(node)
+        else:
+            if node.value is not NULL:
+                node.value = value
+                return
+        for path_node in path:
+            path_node.count += 1
         node.value = value
 
     def __delitem__(self, key):
@@ -384,24 +842,149 @@ class Trie(MutableMapping):
         if node is None or node.value is NULL:
             raise KeyError
         node.value = NULL
+        node.count -= 1
+        for path_node, _ in nodes_parts:
+            path_node.count -= 1
         pop = nodes_parts.pop
         while node.value is NULL and not node.children and nodes_parts:
             node, part = pop()
             del node.children[part]
 
     def clear(self):
-        self._root.children.clear()
+        root = self._root
+        root.children.clear()
+        root.count = int(root.value is not NULL)
 
     def copy(self):
-        clone = copy(super(Trie, self))
-        clone._root = copy(self._root)  # pylint: disable=protected-access
-        return clone
+        return self._with_root(copy(self._root))
 
     def __repr__(self):
         return '%s({%s})' % (
             self.__class__.__name__,
             ', '.join('%r: %r' % t for t in self.iteritems()))
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_root'] = self._flatten_nodes(self._root)
+        return state
+
+    def __setstate__(self, state):
+        state = state.copy()
+        if isinstance(state['_root'], tuple):
+            state['_root'] = self._unflatten_nodes(state['_root'])
+        self.__dict__.update(state)
+
+    def _with_root(self, root):
+        """Return a trie of the same class and attributes as this one with the
+        nodes of ``root``."""
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone._root = root  # pylint: disable=protected-access
+        return clone
+
+    def _as_trie(self, other):
+        if isinstance(other, Trie):
+            return other
+        trie = Trie()
+        trie.update(other)
+        return trie
+
+    def _graft(self, node, source):
+        """Return a subtree for this trie with the items of the subtree
+        ``node`` of the trie ``source``, sharing it if both tries allow it."""
+        # pylint: disable=protected-access
+        if self._shares_nodes and source._shares_nodes and \
+                self.NodeFactory is source.NodeFactory:
+            return node
+        factory = self.NodeFactory
+        clone = factory(node.value)
+        clone.count = node.count
+        stack = [(node, clone)]
+        while stack:
+            node, node_clone = stack.pop()
+            clone_children = node_clone.children
+            for part, child in node.children.items():
+                child_clone = clone_children[part] = factory(child.value)
+                child_clone.count = child.count
+                if child.children:
+                    stack.append((child, child_clone))
+        return clone
+
+    def _combine(self, other, values, keep_self, keep_other, keep_shared):
+        """Return a new trie that combines this trie with the mapping
+        ``other`` by walking their nodes in lockstep.
+
+        :param values: Callable that returns the value of a key given its
+            values in both tries, either of which may be :const:`NULL`.
+        :param keep_self: Whether to keep the subtrees only in this trie.
+        :param keep_other: Whether to keep the subtrees only in ``other``.
+        :param keep_shared: Whether to keep the subtrees shared by both tries,
+            or None to combine them as the others.
+        """
+        other = self._as_trie(other)
+        factory = self.NodeFactory
+        root = factory()
+        # pylint: disable=protected-access
+        stack = [(self._root, other._root, root)]
+        visited = []
+        while stack:
+            node, other_node, result = stack.pop()
+            visited.append(result)
+            result.value = values(node.value, other_node.value)
+            result_children = result.children
+            other_children = other_node.children
+            for part, child in node.children.items():
+                other_child = other_children.get(part)
+                if other_child is None:
+                    if keep_self:
+                        result_children[part] = self._graft(child, self)
+                elif child is other_child and keep_shared is not None:
+                    if keep_shared:
+                        result_children[part] = self._graft(child, self)
+                else:
+                    result_child = result_children[part] = factory()
+                    stack.append((child, other_child, result_child))
+            if keep_other:
+                children = node.children
+                for part, other_child in other_children.items():
+                    if part not in children:
+                        result_children[part] = self._graft(other_child, other)
+        # count the keys and prune the empty nodes, children before parents
+        for result in reversed(visited):
+            count = int(result.value is not NULL)
+            empty = []
+            for part, child in result.children.items():
+                if child.count:
+                    count += child.count
+                else:
+                    empty.append(part)
+            for part in empty:
+                del result.children[part]
+            result.count = count
+        return self._with_root(root)
+
+    def _iter_node_items(self, node, parts):
+        """Iterate over the items of the subtree ``node`` whose key is formed
+        by ``parts``."""
+        key_factory = self.KeyFactory
+        parts = list(parts)
+        if node.value is not NULL:
+            yield (key_factory(parts), node.value)
+        stack = [iter(node.children.items())]
+        while stack:
+            for part, child in stack[-1]:
+                parts.append(part)
+                if child.value is not NULL:
+                    yield (key_factory(parts), child.value)
+                if child.children:
+                    stack.append(iter(child.children.items()))
+                    break
+                del parts[-1]
+            else:
+                stack.pop()
+                if stack:
+                    del parts[-1]
+
     def _find(self, key):
         node = self._root
         for part in key:
@@ -410,22 +993,447 @@ class Trie(MutableMapping):
                 break
         return node
 
+    def _walk_many(self, keys):
+        """Walk the path of each of ``keys``, reusing the path of the previous
+        key for their common prefix.
+
+        Yield a ``(found, node, longest_prefix_value)`` tuple per key, where
+        ``found`` tells whether the whole key was walked, ``node`` is the
+        last node walked and ``longest_prefix_value`` the value of the
+        longest key in this trie that is a prefix of the key (or
+        :const:`NULL`).
+        """
+        root = self._root
+        nodes = [root]
+        values = [root.value]
+        path = []
+        for key in keys:
+            parts = iter(key)
+            depth = len(path)
+            i = 0
+            found = True
+            for part in parts:
+                if i < depth and path[i] == part:
+                    i += 1
+                    continue
+                del nodes[i + 1:], values[i + 1:], path[i:]
+                node, value = nodes[-1], values[-1]
+                while True:
+                    node = node.children.get(part)
+                    if node is None:
+                        found = False
+                        break
+                    if node.value is not NULL:
+                        value = node.value
+                    nodes.append(node)
+                    values.append(value)
+                    path.append(part)
+                    part = next(parts, NULL)
+                    if part is NULL:
+                        break
+                break
+            else:
+                del nodes[i + 1:], values[i + 1:], path[i:]
+            yield found, nodes[-1], values[-1]
+
+    def _insert_sorted(self, items):
+        """Insert ``(key, value)`` items, reusing the path of the previous key.
+
+        The nodes on the path of the previous key are kept "open": the count of
+        an open node excludes the count of its open child, which is added back
+        when the child is closed. The common prefix of consecutive keys is
+        found by comparing slices of them, so it is matched without touching
+        the nodes or updating their counts.
+        """
+        factory = self.NodeFactory
+        close = self._close_nodes
+        nodes = [self._root]
+        push = nodes.append
+        previous = ()
+        try:
+            for key, value in items:
+                if not isinstance(key, (str, tuple)):
+                    key = tuple(key)
+                depth = len(previous)
+                # binary search for the length of the common prefix
+                low = high = min(len(key), depth)
+                if key[:high] != previous[:high]:
+                    low, high = 0, high - 1
+                    while low < high:
+                        middle = (low + high + 1) // 2
+                        if key[:middle] == previous[:middle]:
+                            low = middle
+                        else:
+                            high = middle - 1
+                if low < depth:
+                    close(nodes, low)
+                node = nodes[-1]
+                parts = iter(key[low:])
+                for part in parts:
+                    child = node.children.get(part)
+                    if child is None:
+                        # the rest of the key is new
+                        child = node.children[part] = factory()
+                        push(child)
+                        for part in parts:
+                            node = child
+                            child = node.children[part] = factory()
+                            push(child)
+                        node = child
+                        break
+                    # reopen an existing node
+                    node.count -= child.count
+                    node = child
+                    push(node)
+                if node.value is NULL:
+                    node.count += 1
+                node.value = value
+                previous = key
+        finally:
+            close(nodes, 0)
+
+    @staticmethod
+    def _close_nodes(nodes, depth):
+        """Close the open nodes below ``depth``, adding their counts to their
+        parents."""
+        for i in range(len(nodes) - 1, depth, -1):
+            nodes[i - 1].count += nodes[i].count
+        del nodes[depth + 1:]
+
+    @staticmethod
+    def _flatten_nodes(root):
+        """Encode the subtree rooted at ``root`` without recursion.
+
+        Return a ``(parts, values, sizes)`` tuple, listing the nodes in
+        depth-first order: ``parts`` holds the key part of each node but the
+        root, ``values`` the value of each node and ``sizes`` the number of
+        children of each node.
+        """
+        parts, values = [], [root.value]
+        sizes = array('I', [len(root.children)])
+        append_part, append_value = parts.append, values.append
+        append_size = sizes.append
+        stack = [iter(root.children.items())]
+        while stack:
+            for part, child in stack[-1]:
+                append_part(part)
+                append_value(child.value)
+                append_size(len(child.children))
+                if child.children:
+                    stack.append(iter(child.children.items()))
+                    break
+            else:
+                stack.pop()
+        return parts, values, sizes
+
+    def _unflatten_nodes(self, flat):
+        """Build the nodes encoded by :meth:`_flatten_nodes` and return the
+        root."""
+        parts, values, sizes = flat
+        factory = self.NodeFactory
+        root = factory(values[0])
+        nodes, remaining = [root], [sizes[0]]
+        for part, value, size in zip(parts, islice(values, 1, None),
+                                     islice(sizes, 1, None)):
+            while not remaining[-1]:
+                remaining.pop()
+                done = nodes.pop()
+                nodes[-1].count += done.count
+            remaining[-1] -= 1
+            node = nodes[-1].children[part] = factory(value)
+            nodes.append(node)
+            remaining.append(size)
+        while len(nodes) > 1:
+            done = nodes.pop()
+            nodes[-1].count += done.count
+        return root
+
+    # copy-on-write helpers of ConcurrentTrie and PersistentTrie; ``fresh`` maps
+    # the ids of the nodes created by the current write to the nodes
+
+    def _writable(self, node, fresh):
+        """Return ``node`` if it was created by the current write, otherwise a
+        copy of it that shares its children."""
+        if id(node) in fresh:
+            return node
+        clone = node.__class__(node.value)
+        clone.children.update(node.children)
+        clone.count = node.count
+        fresh[id(clone)] = clone
+        return clone
+
+    def _cow_set(self, root, key, value, fresh):
+        """Return a root with ``key`` set to ``value``, copying the nodes of
+        ``root`` on the path of ``key`` unless they are in ``fresh``."""
+        node = new_root = self._writable(root, fresh)
+        path = []
+        for part in key:
+            child = node.children.get(part)
+            if child is None:
+                child = self.NodeFactory()
+                fresh[id(child)] = child
+            else:
+                child = self._writable(child, fresh)
+            node.children[part] = child
+            path.append(node)
+            node = child
+        if node.value is NULL:
+            node.count += 1
+            for path_node in path:
+                path_node.count += 1
+        node.value = value
+        return new_root
+
+    def _cow_delete(self, root, key, fresh):
+        """Return a root without ``key``, copying the nodes of ``root`` on the
+        path of ``key`` unless they are in ``fresh``."""
+        parts = list(key)
+        node = root
+        for part in parts:
+            node = node.children.get(part)
+            if node is None:
+                raise KeyError
+        if node.value is NULL:
+            raise KeyError
+        node = new_root = self._writable(root, fresh)
+        nodes_parts = []
+        for part in parts:
+            child = self._writable(node.children[part], fresh)
+            node.children[part] = child
+            nodes_parts.append((node, part))
+            node = child
+        node.value = NULL
+        node.count -= 1
+        for path_node, _ in nodes_parts:
+            path_node.count -= 1
+        while node.value is NULL and not node.children and nodes_parts:
+            node, part = nodes_parts.pop()
+            del node.children[part]
+        return new_root
+
+    if _pytrie is not None:
+        # replace the hot paths with their C implementations
+        _find = _pytrie._find  # pylint: disable=protected-access
+        __contains__ = _pytrie.__contains__
+        __getitem__ = _pytrie.__getitem__
+
 
 class StringTrie(Trie):
     """A more appropriate for string keys :class:`Trie`."""
     KeyFactory = ''.join
 
+    def match(self, pattern):
+        """Return an iterator over the items (``(key,value)`` tuples) of this
+        trie whose keys match ``pattern``.
+
+        ``pattern`` is either a sequence of pattern elements as in
+        :meth:`Trie.match` or a shell-style wildcard string, as in
+        :mod:`fnmatch`: ``?`` matches any character, ``*`` any sequence of
+        characters, ``[seq]`` any character in ``seq`` and ``[!seq]`` any
+        character not in ``seq``.
+        """
+        if isinstance(pattern, str):
+            pattern = _parse_glob(pattern)
+        return super(StringTrie, self).match(pattern)
+
+
+class _PartClass:
+    """A set of characters given by members and ranges, optionally negated, as
+    in a ``[seq]`` wildcard."""
+
+    __slots__ = ('chars', 'ranges', 'negated')
+
+    def __init__(self, chars, ranges, negated):
+        self.chars = frozenset(chars)
+        self.ranges = tuple(ranges)
+        self.negated = negated
+
+    def __contains__(self, part):
+        found = part in self.chars or any(low <= part <= high
+                                          for low, high in self.ranges)
+        return found is not self.negated
+
+
+def _parse_glob(pattern):
+    """Translate a shell-style wildcard string to a :meth:`Trie.match`
+    pattern, following the rules of :func:`fnmatch.translate`."""
+    elements = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            if not elements or elements[-1] is not ANY_SEQ:
+                elements.append(ANY_SEQ)
+        elif c == '?':
+            elements.append(ANY)
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] == '!':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                elements.append(c)
+                continue
+            seq, i = pattern[i:j], j + 1
+            negated = seq.startswith('!')
+            if negated:
+                seq = seq[1:]
+            chars, ranges = [], []
+            k = 0
+            while k < len(seq):
+                if k + 2 < len(seq) and seq[k + 1] == '-':
+                    ranges.append((seq[k], seq[k + 2]))
+                    k += 3
+                else:
+                    chars.append(seq[k])
+                    k += 1
+            elements.append(_PartClass(chars, ranges, negated))
+        else:
+            elements.append(c)
+    return elements
+
+
+class _SortedChildren(dict):
+    """A dict that iterates over its keys in sorted order.
+
+    The children are stored in a plain dict, so that inserting and looking up
+    a child costs the same as in an unsorted :class:`Trie`; they are sorted
+    lazily when iterated.
+    """
+
+    __slots__ = ()
+
+    def __iter__(self):
+        return iter(sorted(dict.keys(self)))
+
+    def __reversed__(self):
+        return iter(sorted(dict.keys(self), reverse=True))
+
+    def keys(self):
+        return sorted(dict.keys(self))
+
+    def values(self):
+        if len(self) < 2:
+            return dict.values(self)
+        return [value for _, value in self.items()]
+
+    def items(self):
+        if len(self) < 2:
+            return dict.items(self)
+        return sorted(dict.items(self), key=itemgetter(0))
+
+    def __repr__(self):
+        return '{%s}' % ', '.join('%r: %r' % t for t in self.items())
+
 
 class _SortedNode(Node):
-    ChildrenFactory = sortedcontainers.SortedDict
+    __slots__ = ()
+    ChildrenFactory = _SortedChildren
 
 
 class SortedTrie(Trie):
     """
     A :class:`Trie` that returns its keys (and associated values/items) sorted.
+
+    Its order statistics (:meth:`nth`, :meth:`rank`, :meth:`irange`,
+    :meth:`successor` and :meth:`predecessor`) skip whole subtrees by their
+    key counts, so they visit only the nodes on the path of a single key and
+    their children instead of all the preceding keys.
     """
     NodeFactory = _SortedNode
 
+    def nth(self, index):
+        """Return the key at position ``index`` in the sorted keys of this
+        trie.
+
+        Negative indices count from the end, as with lists; out of range
+        indices raise ``IndexError``.
+        """
+        node = self._root
+        if index < 0:
+            index += node.count
+        if not 0 <= index < node.count:
+            raise IndexError('trie index out of range')
+        parts = []
+        while node.value is NULL or index:
+            if node.value is not NULL:
+                index -= 1
+            for part, child in node.children.items():
+                if index < child.count:
+                    break
+                index -= child.count
+            parts.append(part)  # pylint: disable=undefined-loop-variable
+            node = child  # pylint: disable=undefined-loop-variable
+        return self.KeyFactory(parts)
+
+    def rank(self, key):
+        """Return the number of keys in this trie that sort before ``key``,
+        whether ``key`` is in the trie or not."""
+        return self._rank(key)[0]
+
+    def irange(self, minimum=None, maximum=None, inclusive=(True, True)):
+        """Return an iterator over the sorted keys of this trie between
+        ``minimum`` and ``maximum``.
+
+        :param minimum: If not None, skip the keys that sort before it.
+        :param maximum: If not None, stop at the keys that sort after it.
+        :param inclusive: Pair of booleans telling whether ``minimum`` and
+            ``maximum`` are included if they are keys of the trie.
+        """
+        start, stop = 0, None
+        if minimum is not None:
+            start, found = self._rank(minimum)
+            if found and not inclusive[0]:
+                start += 1
+        if maximum is not None:
+            stop, found = self._rank(maximum)
+            if found and inclusive[1]:
+                stop += 1
+        return TrieView(self).iterkeys(start, stop)
+
+    def successor(self, key):
+        """Return the first key in this trie that sorts after ``key``.
+
+        Raise ``KeyError`` if there is no such key.
+        """
+        index, found = self._rank(key)
+        if found:
+            index += 1
+        if index == len(self):
+            raise KeyError(key)
+        return self.nth(index)
+
+    def predecessor(self, key):
+        """Return the last key in this trie that sorts before ``key``.
+
+        Raise ``KeyError`` if there is no such key.
+        """
+        index = self._rank(key)[0]
+        if not index:
+            raise KeyError(key)
+        return self.nth(index - 1)
+
+    def _rank(self, key):
+        """Return the number of keys that sort before ``key`` and whether
+        ``key`` is in this trie."""
+        rank = 0
+        node = self._root
+        for part in key:
+            if node.value is not NULL:
+                rank += 1
+            for child_part, child in node.children.items():
+                if not child_part < part:
+                    break
+                rank += child.count
+            node = node.children.get(part)
+            if node is None:
+                return rank, False
+        return rank, node.value is not NULL
+
 
 # pylint: disable=too-many-ancestors
 class SortedStringTrie(SortedTrie, StringTrie):
@@ -434,6 +1442,2596 @@ class SortedStringTrie(SortedTrie, StringTrie):
     """
 
 
+class _AlphabetChildren(MutableMapping):
+    """The children of a node of an :class:`AlphabetTrie`.
+
+    The children are kept in a tuple, in the order of their key parts in the
+    alphabet, along with a bitmap that has the bit of each of these parts set.
+    The child of a part is found by counting the bits set below the part's
+    bit, so no hashing of the children is needed and a node takes memory
+    proportional to its children.
+    """
+
+    __slots__ = ('bitmap', 'nodes')
+
+    #: Dict from the parts of the alphabet to their bits.
+    bits = {}
+
+    #: The parts of the alphabet, in order.
+    parts = ()
+
+    def __init__(self):
+        self.bitmap = 0
+        self.nodes = ()
+
+    def get(self, key, default=None):
+        bit = self.bits.get(key, 0)
+        if not self.bitmap & bit:
+            return default
+        return self.nodes[_popcount(self.bitmap & (bit - 1))]
+
+    def __getitem__(self, part):
+        node = self.get(part)
+        if node is None:
+            raise KeyError(part)
+        return node
+
+    def __setitem__(self, part, node):
+        bit = self.bits.get(part)
+        if bit is None:
+            raise ValueError('%r is not in the alphabet' % (part,))
+        i = _popcount(self.bitmap & (bit - 1))
+        if self.bitmap & bit:
+            self.nodes = self.nodes[:i] + (node,) + self.nodes[i + 1:]
+        else:
+            self.nodes = self.nodes[:i] + (node,) + self.nodes[i:]
+            self.bitmap |= bit
+
+    def __delitem__(self, part):
+        bit = self.bits.get(part, 0)
+        if not self.bitmap & bit:
+            raise KeyError(part)
+        i = _popcount(self.bitmap & (bit - 1))
+        self.nodes = self.nodes[:i] + self.nodes[i + 1:]
+        self.bitmap ^= bit
+
+    def __contains__(self, part):
+        return bool(self.bitmap & self.bits.get(part, 0))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        parts, bitmap = self.parts, self.bitmap
+        keys = []
+        while bitmap:
+            bit = bitmap & -bitmap
+            keys.append(parts[bit.bit_length() - 1])
+            bitmap ^= bit
+        return keys
+
+    def values(self):
+        return self.nodes
+
+    def items(self):
+        return list(zip(self.keys(), self.nodes))
+
+    def setdefault(self, key, default=None):
+        node = self.get(key)
+        if node is None:
+            self[key] = node = default
+        return node
+
+    def clear(self):
+        self.bitmap = 0
+        self.nodes = ()
+
+    def __repr__(self):
+        return '{%s}' % ', '.join('%r: %r' % t for t in self.items())
+
+    def __sizeof__(self):
+        size = object.__sizeof__(self)
+        if self.nodes:
+            size += sys.getsizeof(self.nodes)
+        return size
+
+
+def _alphabet_node_factory(alphabet):
+    """Return a node class whose children are keyed by the parts of
+    ``alphabet``."""
+    parts = tuple(alphabet)
+    if len(set(parts)) != len(parts):
+        raise ValueError('the alphabet has duplicate parts')
+    children = type('_AlphabetChildren', (_AlphabetChildren,), {
+        '__slots__': (), 'parts': parts,
+        'bits': {part: 1 << i for i, part in enumerate(parts)}})
+    return type('_AlphabetNode', (Node,), {
+        '__slots__': (), 'ChildrenFactory': children})
+
+
+class AlphabetTrie(Trie):
+    """A :class:`Trie` whose key parts come from a fixed :attr:`Alphabet`.
+
+    The children of a node are kept in a compact array indexed by a bitmap of
+    the parts of the alphabet instead of a dict, which takes a fraction of the
+    memory of a dict. Subclasses set :attr:`Alphabet`, for instance::
+
+        class DNATrie(AlphabetStringTrie):
+            Alphabet = 'ACGT'
+
+    Keys are returned sorted in the order of the alphabet. Setting a key with
+    a part that is not in the alphabet raises ``ValueError``.
+    """
+
+    #: The sequence of the parts that keys may have; set by subclasses, up to
+    #: a few hundred parts.
+    Alphabet = None
+
+    def __init_subclass__(cls, **kwargs):
+        super(AlphabetTrie, cls).__init_subclass__(**kwargs)
+        if 'Alphabet' in cls.__dict__ and 'NodeFactory' not in cls.__dict__:
+            cls.NodeFactory = _alphabet_node_factory(cls.Alphabet)
+
+    def __init__(self, *args, **kwargs):
+        if self.Alphabet is None:
+            raise TypeError('%s has no Alphabet' % self.__class__.__name__)
+        super(AlphabetTrie, self).__init__(*args, **kwargs)
+
+    # the hot paths of Trie, with the children looked up by their bits
+
+    def longest_prefix_value(self, key, default=NULL):
+        bits = self.NodeFactory.ChildrenFactory.bits
+        node = self._root
+        value = node.value
+        for part in key:
+            children = node.children
+            bit = bits.get(part, 0)
+            if not children.bitmap & bit:
+                break
+            node = children.nodes[_popcount(children.bitmap & (bit - 1))]
+            if node.value is not NULL:
+                value = node.value
+        if value is not NULL:
+            return value
+        elif default is not NULL:
+            return default
+        else:
+            raise KeyError
+
+    longest_prefix_value.__doc__ = Trie.longest_prefix_value.__doc__
+
+    def __contains__(self, key):
+        node = self._find(key)
+        return node is not None and node.value is not NULL
+
+    def __getitem__(self, key):
+        node = self._find(key)
+        if node is None or node.value is NULL:
+            raise KeyError
+        return node.value
+
+    def __setitem__(self, key, value):
+        bits = self.NodeFactory.ChildrenFactory.bits
+        node = self._root
+        path = [node]
+        parts = iter(key)
+        for part in parts:
+            children = node.children
+            bit = bits.get(part, 0)
+            if not children.bitmap & bit:
+                # check the rest of the key before adding any of its nodes
+                rest = [part]
+                rest.extend(parts)
+                for part in rest:
+                    if part not in bits:
+                        raise ValueError('%r is not in the alphabet' % (part,))
+                factory = self.NodeFactory
+                node = children[rest[0]] = factory()
+                path.append(node)
+                for part in islice(rest, 1, None):
+                    # the children of the new nodes are empty
+                    children = node.children
+                    node = factory()
+                    children.bitmap, children.nodes = bits[part], (node,)
+                    path.append(node)
+                break
+            node = children.nodes[_popcount(children.bitmap & (bit - 1))]
+            path.append(node)
+        else:
+            if node.value is not NULL:
+                node.value = value
+                return
+        for path_node in path:
+            path_node.count += 1
+        node.value = value
+
+    def _find(self, key):
+        bits = self.NodeFactory.ChildrenFactory.bits
+        node = self._root
+        for part in key:
+            children = node.children
+            bit = bits.get(part, 0)
+            if not children.bitmap & bit:
+                return None
+            node = children.nodes[_popcount(children.bitmap & (bit - 1))]
+        return node
+
+
+class AlphabetStringTrie(AlphabetTrie, StringTrie):
+    """
+    A :class:`Trie` that is both a :class:`StringTrie` and an
+    :class:`AlphabetTrie`.
+    """
+
+
+class BytesTrie(AlphabetTrie):
+    """An :class:`AlphabetTrie` for ``bytes`` keys, whose parts are the byte
+    values 0 to 255."""
+    KeyFactory = bytes
+    Alphabet = range(256)
+
+
+class _ScoredNode(Node):
+    """Node of a :class:`ScoredTrie`.
+
+    :ivar best: The highest score in the subtree rooted at this node or None
+        if the subtree is empty.
+    """
+
+    __slots__ = ('best',)
+
+    def __init__(self, value=NULL):
+        super(_ScoredNode, self).__init__(value)
+        self.best = None
+
+
+class ScoredTrie(Trie):
+    """A :class:`Trie` that finds the highest-scoring items for a prefix
+    without looking at all of them.
+
+    Every node keeps the highest score in its subtree, which is updated on each
+    insertion and deletion, so that :meth:`top_k` is a best-first search that
+    visits only the nodes on the paths of the items it returns and their
+    siblings. Scores must be numbers.
+    """
+
+    NodeFactory = _ScoredNode
+
+    #: Callable that returns the score of a value, or None if the values are
+    #: the scores. Plain functions should be wrapped in ``staticmethod``.
+    ScoreKey = None
+
+    def top_k(self, prefix, k, key=None):
+        """Return the ``k`` items prefixed by ``prefix`` with the highest
+        scores, in descending score order. Items with equal scores are
+        returned in arbitrary order.
+
+        :param key: If not None, score the values with this callable instead of
+            :attr:`ScoreKey`; this looks at every item prefixed by ``prefix``.
+        """
+        if key is not None:
+            return super(ScoredTrie, self).top_k(prefix, k, key)
+        node = self._find(prefix) if prefix is not None else self._root
+        if node is None or node.best is None or k <= 0:
+            return []
+        score = self.ScoreKey
+        key_factory = self.KeyFactory
+        tiebreak = counter()
+        # entries are (-score, is_node, tiebreak, node or value, key parts);
+        # an item is popped before the nodes with the same best score
+        heap = [(-node.best, True, 0, node, tuple(prefix or ()))]
+        top = []
+        while heap:
+            _, is_node, _, node, parts = heappop(heap)
+            if not is_node:
+                top.append((key_factory(parts), node))
+                if len(top) == k:
+                    break
+                continue
+            if node.value is not NULL:
+                value = node.value
+                heappush(heap, (-(score(value) if score else value), False,
+                                next(tiebreak), value, parts))
+            for part, child in node.children.items():
+                if child.best is not None:
+                    heappush(heap, (-child.best, True, next(tiebreak), child,
+                                    parts + (part,)))
+        return top
+
+    def __setitem__(self, key, value):
+        super(ScoredTrie, self).__setitem__(key, value)
+        self._rescore(self._path(key))
+
+    def __delitem__(self, key):
+        path = self._path(key)
+        super(ScoredTrie, self).__delitem__(key)
+        self._rescore(path)
+
+    def clear(self):
+        super(ScoredTrie, self).clear()
+        self._root.best = self._best(self._root)
+
+    def _with_root(self, root):
+        clone = super(ScoredTrie, self)._with_root(root)
+        clone._annotate()  # pylint: disable=protected-access
+        return clone
+
+    def __setstate__(self, state):
+        super(ScoredTrie, self).__setstate__(state)
+        self._annotate()
+
+    def _path(self, key):
+        node = self._root
+        path = [node]
+        for part in key:
+            node = node.children.get(part)
+            if node is None:
+                break
+            path.append(node)
+        return path
+
+    def _best(self, node):
+        score = self.ScoreKey
+        if node.value is NULL:
+            best = None
+        else:
+            best = score(node.value) if score else node.value
+        for child in node.children.values():
+            child_best = child.best
+            if child_best is not None and (best is None or child_best > best):
+                best = child_best
+        return best
+
+    def _rescore(self, path):
+        """Update the best scores of ``path``, a list of nodes starting from the
+        root, after the value of its last node changed."""
+        child_best = None
+        for i in range(len(path) - 1, -1, -1):
+            node = path[i]
+            old_best = node.best
+            if child_best is not None and (old_best is None or
+                                           child_best >= old_best):
+                # the child now holds the best score of the whole subtree
+                node.best = child_best
+            else:
+                node.best = self._best(node)
+            if node.best == old_best:
+                break
+            child_best = node.best
+
+    def _annotate(self):
+        """Compute the best scores of all nodes, children before parents."""
+        stack = [self._root]
+        postorder = []
+        while stack:
+            node = stack.pop()
+            postorder.append(node)
+            stack.extend(node.children.values())
+        for node in reversed(postorder):
+            node.best = self._best(node)
+
+
+# pylint: disable=too-many-ancestors
+class ScoredStringTrie(ScoredTrie, StringTrie):
+    """
+    A :class:`Trie` that is both a :class:`StringTrie` and a :class:`ScoredTrie`
+    """
+
+
+class ConcurrentTrie(Trie):
+    """A :class:`Trie` that can be shared by writer and reader threads.
+
+    The nodes reachable from the root of the trie are never modified. Writers
+    copy the nodes on the path of the key they change (copy-on-write) and then
+    publish the new root with a single attribute assignment, under a lock that
+    serializes them. Readers take no lock: every read operation, including an
+    iteration, sees the consistent snapshot of the root it started with, so it
+    is safe in free-threaded (no-GIL) builds too. :meth:`copy` takes constant
+    time since it shares the root.
+    """
+
+    _shares_nodes = True
+
+    def __init__(self, *args, **kwargs):
+        self._lock = threading.RLock()
+        super(ConcurrentTrie, self).__init__(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._root = self._cow_set(self._root, key, value, {})
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._root = self._cow_delete(self._root, key, {})
+
+    def update(self, *args, **kwargs):  # pylint: disable=arguments-differ
+        """Update this trie from a mapping or iterable of items and/or
+        keyword arguments, as ``dict.update()``.
+
+        Unless :meth:`__setitem__` is overridden, the items are published at
+        once when all of them are inserted.
+        """
+        if type(self).__setitem__ is not ConcurrentTrie.__setitem__:
+            with self._lock:
+                MutableMapping.update(self, *args, **kwargs)
+            return
+        if len(args) > 1:
+            raise TypeError('update expected at most 1 arguments, got %d' %
+                            len(args))
+        items = []
+        if args:
+            other = args[0]
+            if isinstance(other, Mapping) or hasattr(other, 'keys'):
+                items.append((key, other[key]) for key in other.keys())
+            else:
+                items.append(other)
+        if kwargs:
+            items.append(kwargs.items())
+        with self._lock:
+            root, fresh = self._root, {}
+            for batch in items:
+                for key, value in batch:
+                    root = self._cow_set(root, key, value, fresh)
+            self._root = root
+
+    def setdefault(self, key, default=None):
+        with self._lock:
+            return super(ConcurrentTrie, self).setdefault(key, default)
+
+    def pop(self, key, *default):  # pylint: disable=arguments-differ
+        with self._lock:
+            return super(ConcurrentTrie, self).pop(key, *default)
+
+    def popitem(self):
+        with self._lock:
+            return super(ConcurrentTrie, self).popitem()
+
+    def clear(self):
+        with self._lock:
+            self._root = self.NodeFactory(self._root.value)
+
+    def copy(self):
+        return self._with_root(self._root)
+
+    def _with_root(self, root):
+        clone = super(ConcurrentTrie, self)._with_root(root)
+        clone._lock = threading.RLock()  # pylint: disable=protected-access
+        return clone
+
+    def __getstate__(self):
+        state = super(ConcurrentTrie, self).__getstate__()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        super(ConcurrentTrie, self).__setstate__(state)
+        self._lock = threading.RLock()
+
+
+# pylint: disable=too-many-ancestors
+class ConcurrentStringTrie(ConcurrentTrie, StringTrie):
+    """
+    A :class:`Trie` that is both a :class:`StringTrie` and a
+    :class:`ConcurrentTrie`
+    """
+
+
+class PersistentTrie(Trie):
+    """An immutable :class:`Trie` whose updates return a new trie.
+
+    :meth:`set` and :meth:`delete` copy only the nodes on the path of the key
+    and share all the other nodes with the original trie, so an update takes
+    time and memory proportional to the key length, and :meth:`copy` takes
+    constant time. The in-place mutating methods of the mapping API raise
+    ``TypeError``.
+    """
+
+    _shares_nodes = True
+
+    def __init__(self, *args, **kwargs):
+        """Create a new persistent trie.
+
+        Parameters are the same with ``dict()``.
+        """
+        # pylint: disable=super-init-not-called
+        # build the nodes in place before they are shared
+        trie = Trie()
+        trie.NodeFactory = self.NodeFactory  # pylint: disable=invalid-name
+        trie.update(*args, **kwargs)
+        self._root = trie._root  # pylint: disable=protected-access
+
+    @classmethod
+    def fromkeys(cls, iterable, value=None):
+        return cls((key, value) for key in iterable)
+
+    @classmethod
+    def from_sorted(cls, items):
+        return cls(items)
+
+    def set(self, key, value):
+        """Return a new trie with the items of this trie and ``key`` set to
+        ``value``."""
+        return self._with_root(self._cow_set(self._root, key, value, {}))
+
+    def set_many(self, *args, **kwargs):
+        """Return a new trie with the items of this trie updated from a mapping
+        or iterable of items and/or keyword arguments, as ``dict.update()``.
+        """
+        fresh = {}
+        root = self._root
+        for key, value in PersistentTrie(*args, **kwargs).iteritems():
+            root = self._cow_set(root, key, value, fresh)
+        return self._with_root(root)
+
+    def delete(self, key):
+        """Return a new trie with the items of this trie except for ``key``.
+
+        Raise ``KeyError`` if ``key`` is not in this trie.
+        """
+        return self._with_root(self._cow_delete(self._root, key, {}))
+
+    def copy(self):
+        return self
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('%r object is immutable' % self.__class__.__name__)
+
+    __setitem__ = __delitem__ = update = clear = _immutable
+    pop = popitem = setdefault = _immutable
+
+
+# pylint: disable=too-many-ancestors
+class PersistentStringTrie(PersistentTrie, StringTrie):
+    """
+    A :class:`Trie` that is both a :class:`StringTrie` and a
+    :class:`PersistentTrie`
+    """
+
+
+class CachedTrie(Trie):
+    """A :class:`Trie` that caches the results of its lookups.
+
+    The results of :meth:`__getitem__`, :meth:`__contains__` and the
+    ``longest_prefix*`` and ``iter_prefix*`` methods are kept in a least
+    recently used cache of up to :attr:`CacheSize` entries, keyed by the
+    looked up key and a generation counter. Every update of the trie bumps the
+    counter, which invalidates all the cached results at once, so the cache
+    pays off for tries that are read much more often than updated, with a few
+    keys making up most of the lookups. Unhashable keys, such as lists,
+    bypass the cache.
+    """
+
+    #: The maximum number of cached results.
+    CacheSize = 1024
+
+    def __init__(self, *args, **kwargs):
+        self._generation = 0
+        self._cache = self._new_cache()
+        super(CachedTrie, self).__init__(*args, **kwargs)
+
+    def cache_info(self):
+        """Return the hits, misses, maximum and current size of the cache, as
+        ``functools.lru_cache`` does."""
+        return self._cache.cache_info()
+
+    def cache_clear(self):
+        """Clear the cache and its statistics."""
+        self._cache.cache_clear()
+
+    #----- cached lookups ------------------------------------------------------
+
+    def longest_prefix_value(self, key, default=NULL):
+        item = self._cached(CachedTrie._longest_prefix_item, key)
+        if item is not NULL:
+            return item[1]
+        elif default is not NULL:
+            return default
+        else:
+            raise KeyError
+
+    def longest_prefix_item(self, key, default=NULL):
+        item = self._cached(CachedTrie._longest_prefix_item, key)
+        if item is not NULL:
+            return item
+        elif default is not NULL:
+            return default
+        else:
+            raise KeyError
+
+    def iter_prefixes(self, key):
+        return (prefix for prefix, _ in self.iter_prefix_items(key))
+
+    def iter_prefix_values(self, key):
+        return (value for _, value in self.iter_prefix_items(key))
+
+    def iter_prefix_items(self, key):
+        return iter(self._cached(CachedTrie._prefix_items, key))
+
+    def __contains__(self, key):
+        return self._cached(CachedTrie._value, key) is not NULL
+
+    def __getitem__(self, key):
+        value = self._cached(CachedTrie._value, key)
+        if value is NULL:
+            raise KeyError
+        return value
+
+    #----- invalidating updates ------------------------------------------------
+
+    def __setitem__(self, key, value):
+        self._generation += 1
+        super(CachedTrie, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._generation += 1
+        super(CachedTrie, self).__delitem__(key)
+
+    def clear(self):
+        self._generation += 1
+        super(CachedTrie, self).clear()
+
+    def __getstate__(self):
+        state = super(CachedTrie, self).__getstate__()
+        del state['_cache']
+        return state
+
+    def __setstate__(self, state):
+        super(CachedTrie, self).__setstate__(state)
+        self._cache = self._new_cache()
+
+    def _with_root(self, root):
+        clone = super(CachedTrie, self)._with_root(root)
+        clone._cache = clone._new_cache()  # pylint: disable=protected-access
+        return clone
+
+    def _new_cache(self):
+        return lru_cache(self.CacheSize)(self._lookup)
+
+    def _cached(self, lookup, key):
+        """Return ``lookup(self, key)``, from the cache if it holds a result of
+        the current generation."""
+        try:
+            return self._cache(lookup, key, self._generation)
+        except TypeError:
+            # unhashable key
+            return lookup(self, key)
+
+    def _lookup(self, lookup, key, generation):  # pylint: disable=unused-argument
+        return lookup(self, key)
+
+    # the uncached lookups, returning NULL for missing results
+
+    def _value(self, key):
+        node = self._find(key)
+        return node.value if node is not None else NULL
+
+    def _longest_prefix_item(self, key):
+        try:
+            return super(CachedTrie, self).longest_prefix_item(key)
+        except KeyError:
+            return NULL
+
+    def _prefix_items(self, key):
+        return tuple(super(CachedTrie, self).iter_prefix_items(key))
+
+
+class CachedStringTrie(CachedTrie, StringTrie):
+    """
+    A :class:`Trie` that is both a :class:`StringTrie` and a
+    :class:`CachedTrie`.
+    """
+
+
+class InstrumentedTrie(Trie):
+    """A :class:`Trie` that counts the nodes visited by its operations.
+
+    :attr:`counters` is a ``collections.Counter`` with the number of calls of
+    each instrumented operation, ``'find'`` (the key lookups of
+    :meth:`__getitem__`, :meth:`__contains__` and their siblings),
+    ``'prefix'`` (the prefix lookups of :meth:`longest_prefix_value`,
+    :meth:`iter_prefix_values` and their siblings), ``'setitem'``,
+    ``'delitem'`` and ``'traverse'`` (:meth:`iteritems` and its siblings),
+    and with the total number of nodes they visited under
+    ``'<operation>_nodes'``. The iterators of prefix lookups and traversals
+    are counted when they are exhausted or closed.
+
+    If :attr:`hook` is not None, it is also called with the operation, the
+    key (the prefix for traversals) and the number of visited nodes of every
+    call, for instance to feed a metrics system or to log the keys that visit
+    the most nodes. The lookups are implemented in Python and bypass the C
+    accelerator.
+    """
+
+    def __init__(self, *args, **kwargs):
+        #: The operation counters.
+        self.counters = Counter()
+        #: Callable called with ``(operation, key, nodes)`` after every
+        #: instrumented operation, or None.
+        self.hook = None
+        super(InstrumentedTrie, self).__init__(*args, **kwargs)
+
+    def itervalues(self, prefix=None):
+        return (value for _, value in self._traverse(prefix))
+
+    def iteritems(self, prefix=None):
+        return self._traverse(prefix)
+
+    def longest_prefix_value(self, key, default=NULL):
+        longest_prefix_value = NULL
+        for _, node in self._iter_prefix_nodes(key):
+            longest_prefix_value = node.value
+        if longest_prefix_value is not NULL:
+            return longest_prefix_value
+        elif default is not NULL:
+            return default
+        else:
+            raise KeyError
+
+    def longest_prefix_item(self, key, default=NULL):
+        prefix = []
+        longest_prefix_length, longest_prefix_value = 0, NULL
+        for length, node in self._iter_prefix_nodes(key, prefix):
+            longest_prefix_length, longest_prefix_value = length, node.value
+        if longest_prefix_value is not NULL:
+            return (self.KeyFactory(prefix[:longest_prefix_length]),
+                    longest_prefix_value)
+        elif default is not NULL:
+            return default
+        else:
+            raise KeyError
+
+    def iter_prefixes(self, key):
+        key_factory = self.KeyFactory
+        prefix = []
+        return (key_factory(prefix[:length])
+                for length, _ in self._iter_prefix_nodes(key, prefix))
+
+    def iter_prefix_values(self, key):
+        return (node.value for _, node in self._iter_prefix_nodes(key))
+
+    def iter_prefix_items(self, key):
+        key_factory = self.KeyFactory
+        prefix = []
+        return ((key_factory(prefix[:length]), node.value)
+                for length, node in self._iter_prefix_nodes(key, prefix))
+
+    def __contains__(self, key):
+        node = self._find(key)
+        return node is not None and node.value is not NULL
+
+    def __getitem__(self, key):
+        node = self._find(key)
+        if node is None or node.value is NULL:
+            raise KeyError
+        return node.value
+
+    def __setitem__(self, key, value):
+        parts = list(key)
+        super(InstrumentedTrie, self).__setitem__(parts, value)
+        self._record('setitem', key, len(parts) + 1)
+
+    def __delitem__(self, key):
+        parts = list(key)
+        try:
+            super(InstrumentedTrie, self).__delitem__(parts)
+        except KeyError:
+            self._record('delitem', key, self._path_length(parts))
+            raise
+        self._record('delitem', key, len(parts) + 1)
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        state = super(InstrumentedTrie, self).__getstate__()
+        del state['counters'], state['hook']
+        clone = self.__class__.__new__(self.__class__)
+        memo[id(self)] = clone
+        clone.__setstate__(deepcopy(state, memo))
+        clone.counters = Counter()
+        clone.hook = self.hook
+        return clone
+
+    def __getstate__(self):
+        state = super(InstrumentedTrie, self).__getstate__()
+        state['hook'] = None
+        return state
+
+    def _with_root(self, root):
+        clone = super(InstrumentedTrie, self)._with_root(root)
+        clone.counters = Counter()
+        return clone
+
+    def _find(self, key):
+        node = self._root
+        nodes = 1
+        for part in key:
+            node = node.children.get(part)
+            if node is None:
+                break
+            nodes += 1
+        self._record('find', key, nodes)
+        return node
+
+    def _iter_prefix_nodes(self, key, prefix=None):
+        """Yield ``(prefix_length, node)`` tuples for the nodes with a value on
+        the path of ``key`` and record the lookup when done.
+
+        If ``prefix`` is a list, the parts of ``key`` that have been walked are
+        appended to it.
+        """
+        node = self._root
+        nodes = 1
+        try:
+            if node.value is not NULL:
+                yield 0, node
+            for length, part in enumerate(key, 1):
+                node = node.children.get(part)
+                if node is None:
+                    break
+                nodes += 1
+                if prefix is not None:
+                    prefix.append(part)
+                if node.value is not NULL:
+                    yield length, node
+        finally:
+            self._record('prefix', key, nodes)
+
+    def _path_length(self, parts):
+        """Return the number of nodes on the path of ``parts``."""
+        node = self._root
+        nodes = 1
+        for part in parts:
+            node = node.children.get(part)
+            if node is None:
+                break
+            nodes += 1
+        return nodes
+
+    def _record(self, operation, key, nodes):
+        counters = self.counters
+        counters[operation] += 1
+        counters[operation + '_nodes'] += nodes
+        if self.hook is not None:
+            self.hook(operation, key, nodes)
+
+    def _traverse(self, prefix):
+        key_factory = self.KeyFactory
+        node = self._root
+        parts = []
+        nodes = 1
+        if prefix is not None:
+            for part in prefix:
+                node = node.children.get(part)
+                if node is None:
+                    break
+                parts.append(part)
+                nodes += 1
+        try:
+            if node is None:
+                return
+            if node.value is not NULL:
+                yield (key_factory(parts), node.value)
+            stack = [iter(node.children.items())]
+            while stack:
+                for part, child in stack[-1]:
+                    nodes += 1
+                    parts.append(part)
+                    if child.value is not NULL:
+                        yield (key_factory(parts), child.value)
+                    if child.children:
+                        stack.append(iter(child.children.items()))
+                        break
+                    del parts[-1]
+                else:
+                    stack.pop()
+                    if stack:
+                        del parts[-1]
+        finally:
+            self._record('traverse', prefix, nodes)
+
+
+class InstrumentedStringTrie(InstrumentedTrie, StringTrie):
+    """
+    A :class:`Trie` that is both a :class:`StringTrie` and an
+    :class:`InstrumentedTrie`.
+    """
+
+
+class TrieView(Mapping):
+    """A read-only, live view of the items of a :class:`Trie` whose keys start
+    with a given prefix.
+
+    The keys of the view are full keys of the trie, including the prefix.
+    The view supports the read-only mapping API, :meth:`view` for narrowing it
+    further and the ``start``/``stop`` arguments of :meth:`iteritems` and its
+    siblings for pagination. Its length is looked up in time proportional to
+    the length of the prefix and pagination skips whole subtrees by their key
+    counts, so a page of results touches only the nodes on its path.
+    """
+
+    def __init__(self, trie, prefix=None):
+        self._trie = trie
+        self._prefix = list(prefix) if prefix is not None else []
+
+    @property
+    def prefix(self):
+        """The prefix of the keys of this view."""
+        return self._trie.KeyFactory(self._prefix)
+
+    def view(self, suffix):
+        """Return a view of the items of this view whose keys continue with
+        ``suffix`` after the prefix of this view."""
+        return TrieView(self._trie, self._prefix + list(suffix))
+
+    def keys(self, start=None, stop=None):
+        """Return a list of the keys of this view.
+
+        :param start: If not None, skip the first ``start`` keys.
+        :param stop: If not None, stop before the ``stop``-th key.
+        """
+        return list(self.iterkeys(start, stop))
+
+    def values(self, start=None, stop=None):
+        """Return a list of the values of this view, sliced as in
+        :meth:`keys`."""
+        return list(self.itervalues(start, stop))
+
+    def items(self, start=None, stop=None):
+        """Return a list of the items of this view, sliced as in
+        :meth:`keys`."""
+        return list(self.iteritems(start, stop))
+
+    def iterkeys(self, start=None, stop=None):
+        """Return an iterator over the keys of this view, sliced as in
+        :meth:`keys`."""
+        return (key for key, _ in self.iteritems(start, stop))
+
+    def itervalues(self, start=None, stop=None):
+        """Return an iterator over the values of this view, sliced as in
+        :meth:`keys`."""
+        return (value for _, value in self.iteritems(start, stop))
+
+    def iteritems(self, start=None, stop=None):
+        """Return an iterator over the items of this view, sliced as in
+        :meth:`keys`."""
+        start = _slice_index(start, 0)
+        stop = _slice_index(stop, None)
+        if not start:
+            items = self._trie.iteritems(self._prefix)
+        else:
+            items = self._iteritems_from(start)
+        if stop is None:
+            return items
+        return islice(items, max(stop - start, 0))
+
+    def __len__(self):
+        node = self._find()
+        return node.count if node is not None else 0
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __contains__(self, key):
+        key = list(key)
+        return key[:len(self._prefix)] == self._prefix and key in self._trie
+
+    def __getitem__(self, key):
+        key = list(key)
+        if key[:len(self._prefix)] != self._prefix:
+            raise KeyError
+        return self._trie[key]
+
+    def __repr__(self):
+        return '%s.view(%r)' % (self._trie.__class__.__name__, self.prefix)
+
+    def _find(self):
+        return self._trie._find(self._prefix)  # pylint: disable=protected-access
+
+    def _iteritems_from(self, start):
+        """Iterate over the items of this view, skipping the first ``start``
+        without visiting the subtrees that hold them."""
+        root = self._find()
+        if root is None or root.count <= start:
+            return
+        key_factory = self._trie.KeyFactory
+        parts = list(self._prefix)
+        if root.value is not NULL:
+            start -= 1
+        stack = [iter(root.children.items())]
+        while stack:
+            for part, child in stack[-1]:
+                if start >= child.count:
+                    start -= child.count
+                    continue
+                parts.append(part)
+                if child.value is not NULL:
+                    if start:
+                        start -= 1
+                    else:
+                        yield (key_factory(parts), child.value)
+                if child.children:
+                    stack.append(iter(child.children.items()))
+                    break
+                del parts[-1]
+            else:
+                stack.pop()
+                if stack:
+                    del parts[-1]
+
+
+def _slice_index(index, default):
+    if index is None:
+        return default
+    index = index.__index__()
+    if index < 0:
+        raise ValueError('view indices must be None or non-negative integers')
+    return index
+
+
+class _CompressedNode(Node):
+    """Node of a :class:`CompressedTrie`.
+
+    :ivar label: The key parts of the edge leading to this node, as returned by
+        the trie's :attr:`~CompressedTrie.KeyFactory`.
+    """
+
+    __slots__ = ('label',)
+
+    def __init__(self, label, value=NULL):
+        super(_CompressedNode, self).__init__(value)
+        self.label = label
+
+    def __repr__(self):
+        return '(%r, %s, {%s})' % (
+            self.label,
+            self.value is NULL and 'NULL' or repr(self.value),
+            ', '.join('%r: %r' % t for t in self.children.items()))
+
+    def __copy__(self):
+        clone = self.__class__(self.label, self.value)
+        clone.count = self.count
+        stack = [(self, clone)]
+        while stack:
+            node, node_clone = stack.pop()
+            clone_children = node_clone.children
+            for part, child in node.children.items():
+                child_clone = child.__class__(child.label, child.value)
+                child_clone.count = child.count
+                clone_children[part] = child_clone
+                stack.append((child, child_clone))
+        return clone
+
+    def __getstate__(self):
+        return self.label, self.value, self.children, self.count
+
+    def __setstate__(self, state):
+        self.label, self.value, self.children, self.count = state
+
+
+class CompressedTrie(MutableMapping):
+    """A path-compressed (radix) trie.
+
+    Chains of nodes that have a single child and no value are collapsed into a
+    single edge labelled with all their key parts. This saves one node per
+    collapsed key part and one hop per collapsed part on lookups, which pays
+    off for keys with long unshared suffixes such as URLs or file paths.
+
+    :class:`CompressedTrie` supports the same mapping and prefix API as
+    :class:`Trie`. Keys are converted with :attr:`KeyFactory` before they are
+    stored, so their parts must be sliceable after conversion.
+    """
+
+    #: Callable for forming a key from its parts. Edge labels are formed with
+    #: it as well.
+    KeyFactory = tuple
+
+    #: Callable for creating new trie nodes; it is passed the edge label.
+    NodeFactory = _CompressedNode
+
+    def __init__(self, *args, **kwargs):
+        """Create a new compressed trie.
+
+        Parameters are the same with ``dict()``.
+        """
+        self._root = self.NodeFactory(self.KeyFactory(()))
+        self.update(*args, **kwargs)
+
+    @classmethod
+    def fromkeys(cls, iterable, value=None):
+        """
+        Create a new trie with keys from ``iterable`` and values set to
+        ``value``.
+
+        Parameters are the same with ``dict.fromkeys()``.
+        """
+        trie = cls()
+        for key in iterable:
+            trie[key] = value
+        return trie
+
+    #----- trie-specific methods -----------------------------------------------
+
+    def count(self, prefix=None):
+        """Return the number of keys in this trie.
+
+        :param prefix: If not None, count only the keys prefixed by ``prefix``.
+        """
+        if prefix is None:
+            return self._root.count
+        node = self._find_prefix(self.KeyFactory(prefix))[0]
+        return node.count if node is not None else 0
+
+    def longest_prefix(self, key, default=NULL):
+        """Return the longest key in this trie that is a prefix of ``key``.
+
+        If the trie doesn't contain any prefix of ``key``:
+          - if ``default`` is given, return it
+          - otherwise raise ``KeyError``
+        """
+        try:
+            return self.longest_prefix_item(key)[0]
+        except KeyError:
+            if default is not NULL:
+                return default
+            raise
+
+    def longest_prefix_value(self, key, default=NULL):
+        """Return the value associated with the longest key in this trie that is
+        a prefix of ``key``.
+
+        If the trie doesn't contain any prefix of ``key``:
+          - if ``default`` is given, return it
+          - otherwise raise ``KeyError``
+        """
+        longest_prefix_value = NULL
+        for _, value in self._iter_prefix_nodes(key):
+            longest_prefix_value = value
+        if longest_prefix_value is not NULL:
+            return longest_prefix_value
+        elif default is not NULL:
+            return default
+        else:
+            raise KeyError
+
+    def longest_prefix_item(self, key, default=NULL):
+        """Return the item (``(key,value)`` tuple) associated with the longest
+        key in this trie that is a prefix of ``key``.
+
+        If the trie doesn't contain any prefix of ``key``:
+          - if ``default`` is given, return it
+          - otherwise raise ``KeyError``
+        """
+        key = self.KeyFactory(key)
+        longest_prefix_item = NULL
+        for end, value in self._iter_prefix_nodes(key):
+            longest_prefix_item = (end, value)
+        if longest_prefix_item is not NULL:
+            end, value = longest_prefix_item
+            return key[:end], value
+        elif default is not NULL:
+            return default
+        else:
+            raise KeyError
+
+    def iter_prefixes(self, key):
+        """
+        Return an iterator over the keys of this trie that are prefixes of
+        ``key``.
+        """
+        key = self.KeyFactory(key)
+        for end, _ in self._iter_prefix_nodes(key):
+            yield key[:end]
+
+    def iter_prefix_values(self, key):
+        """Return an iterator over the values of this trie that are associated
+        with keys that are prefixes of ``key``.
+        """
+        for _, value in self._iter_prefix_nodes(key):
+            yield value
+
+    def iter_prefix_items(self, key):
+        """Return an iterator over the items (``(key,value)`` tuples) of this
+        trie that are associated with keys that are prefixes of ``key``.
+        """
+        key = self.KeyFactory(key)
+        for end, value in self._iter_prefix_nodes(key):
+            yield (key[:end], value)
+
+    #----- extended mapping API methods ----------------------------------------
+
+     # pylint: disable=arguments-differ
+
+    def keys(self, prefix=None):
+        """Return a list of this trie's keys.
+
+        :param prefix: If not None, return only the keys prefixed by ``prefix``.
+        """
+        return list(self.iterkeys(prefix))
+
+    def values(self, prefix=None):
+        """Return a list of this trie's values.
+
+        :param prefix: If not None, return only the values associated with keys
+            prefixed by ``prefix``.
+        """
+        return list(self.itervalues(prefix))
+
+    def items(self, prefix=None):
+        """Return a list of this trie's items (``(key,value)`` tuples).
+
+        :param prefix: If not None, return only the items associated with keys
+            prefixed by ``prefix``.
+        """
+        return list(self.iteritems(prefix))
+
+    def iterkeys(self, prefix=None):
+        """Return an iterator over this trie's keys.
+
+        :param prefix: If not None, yield only the keys prefixed by ``prefix``.
+        """
+        return (key for key, value in self.iteritems(prefix))
+
+    def itervalues(self, prefix=None):
+        """Return an iterator over this trie's values.
+
+        :param prefix: If not None, yield only the values associated with keys
+            prefixed by ``prefix``.
+        """
+        return (value for key, value in self.iteritems(prefix))
+
+    def iteritems(self, prefix=None):
+        """Return an iterator over this trie's items (``(key,value)`` tuples).
+
+        :param prefix: If not None, yield only the items associated with keys
+            prefixed by ``prefix``.
+        """
+        if prefix is None:
+            root, root_key = self._root, self._root.label
+        else:
+            root, root_key = self._find_prefix(self.KeyFactory(prefix))
+            if root is None:
+                return iter(())
+        return self._iter_subtree(root, root_key)
+
+     # pylint: enable=arguments-differ
+
+    #----- original mapping API methods ----------------------------------------
+
+    def __len__(self):
+        return self._root.count
+
+    def __bool__(self):
+        return self._root.count > 0
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __contains__(self, key):
+        node = self._find(key)
+        return node is not None and node.value is not NULL
+
+    def __getitem__(self, key):
+        node = self._find(key)
+        if node is None or node.value is NULL:
+            raise KeyError
+        return node.value
+
+    def __setitem__(self, key, value):
+        key = self.KeyFactory(key)
+        key_length = len(key)
+        factory = self.NodeFactory
+        node = self._root
+        path = [node]
+        i = 0
+        while i < key_length:
+            children = node.children
+            child = children.get(key[i])
+            if child is None:
+                node = children[key[i]] = factory(key[i:])
+                path.append(node)
+                break
+            label = child.label
+            j, label_length = 1, len(label)
+            while j < label_length and i + j < key_length and \
+                    label[j] == key[i + j]:
+                j += 1
+            if j < label_length:
+                # split the edge at the first mismatch
+                middle = factory(label[:j])
+                middle.count = child.count
+                child.label = label[j:]
+                middle.children[label[j]] = child
+                children[key[i]] = middle
+                child = middle
+            node = child
+            path.append(node)
+            i += j
+        if node.value is NULL:
+            for path_node in path:
+                path_node.count += 1
+        node.value = value
+
+    def __delitem__(self, key):
+        key = self.KeyFactory(key)
+        path = []
+        node = self._root
+        i, key_length = 0, len(key)
+        while i < key_length:
+            child = node.children.get(key[i])
+            if child is None:
+                raise KeyError
+            label = child.label
+            if key[i:i + len(label)] != label:
+                raise KeyError
+            path.append(node)
+            node = child
+            i += len(label)
+        if node.value is NULL:
+            raise KeyError
+        node.value = NULL
+        node.count -= 1
+        for path_node in path:
+            path_node.count -= 1
+        if not path:
+            return
+        parent = path[-1]
+        if not node.children:
+            del parent.children[node.label[0]]
+            # the parent may now be a valueless node with a single child
+            node = parent
+            if len(path) < 2:
+                return
+            parent = path[-2]
+        if node.value is NULL and len(node.children) == 1:
+            for child in node.children.values():
+                child.label = node.label + child.label
+                parent.children[node.label[0]] = child
+
+    def clear(self):
+        root = self._root
+        root.children.clear()
+        root.count = int(root.value is not NULL)
+
+    def copy(self):
+        clone = copy(super(CompressedTrie, self))
+        clone._root = copy(self._root)  # pylint: disable=protected-access
+        return clone
+
+    def __repr__(self):
+        return '%s({%s})' % (
+            self.__class__.__name__,
+            ', '.join('%r: %r' % t for t in self.iteritems()))
+
+    def _find(self, key):
+        key = self.KeyFactory(key)
+        node = self._root
+        i, key_length = 0, len(key)
+        while i < key_length:
+            node = node.children.get(key[i])
+            if node is None:
+                return None
+            label = node.label
+            if key[i:i + len(label)] != label:
+                return None
+            i += len(label)
+        return node
+
+    def _find_prefix(self, prefix):
+        """Find the topmost node whose key starts with ``prefix``.
+
+        Return a ``(node, node_key)`` tuple, or ``(None, None)`` if no key
+        starts with ``prefix``. ``prefix`` must be converted with
+        :attr:`KeyFactory`.
+        """
+        node = self._root
+        node_key = node.label
+        i, prefix_length = 0, len(prefix)
+        while i < prefix_length:
+            node = node.children.get(prefix[i])
+            if node is None:
+                return None, None
+            label = node.label
+            remaining = prefix[i:i + len(label)]
+            if label[:len(remaining)] != remaining:
+                return None, None
+            node_key = prefix[:i] + label
+            i += len(label)
+        return node, node_key
+
+    def _iter_prefix_nodes(self, key):
+        """Yield ``(end, value)`` tuples for the keys of this trie that are
+        prefixes of ``key``, where ``end`` is the length of the prefix.
+        """
+        key = self.KeyFactory(key)
+        node = self._root
+        if node.value is not NULL:
+            yield 0, node.value
+        i, key_length = 0, len(key)
+        while i < key_length:
+            node = node.children.get(key[i])
+            if node is None:
+                break
+            label = node.label
+            if key[i:i + len(label)] != label:
+                break
+            i += len(label)
+            if node.value is not NULL:
+                yield i, node.value
+
+    @staticmethod
+    def _iter_subtree(root, root_key, null=NULL):
+        stack = [(root, root_key)]
+        pop, extend = stack.pop, stack.extend
+        while stack:
+            node, key = pop()
+            if node.value is not null:
+                yield key, node.value
+            if node.children:
+                extend((child, key + child.label)
+                       for child in reversed(node.children.values()))
+
+
+class CompressedStringTrie(CompressedTrie):
+    """A more appropriate for string keys :class:`CompressedTrie`."""
+    KeyFactory = ''.join
+
+
+class SuffixStringTrie(StringTrie):
+    """A :class:`StringTrie` that also finds its keys by substring.
+
+    Every non-empty suffix of every key is indexed in a
+    :class:`CompressedStringTrie` mapping it to the keys that end with it, so
+    the keys containing a substring are the keys of the suffixes that start
+    with it. A substring query walks the index along the substring and then
+    visits only the matching suffixes, regardless of the number of keys.
+    Path compression keeps the index to one node per branching point, but it
+    still holds all the suffixes, which suits short keys such as
+    identifiers or words rather than long texts.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Create a new suffix trie.
+
+        Parameters are the same with ``dict()``.
+        """
+        self._suffixes = CompressedStringTrie()
+        super(SuffixStringTrie, self).__init__(*args, **kwargs)
+
+    #----- substring methods ---------------------------------------------------
+
+    def iter_substring_keys(self, substring):
+        """Return an iterator over the keys of this trie that contain
+        ``substring``."""
+        if not substring:
+            return self.iterkeys()
+        return self._iter_substring_keys(substring)
+
+    def iter_substring_values(self, substring):
+        """Return an iterator over the values of this trie whose keys contain
+        ``substring``."""
+        return (value for _, value in self.iter_substring_items(substring))
+
+    def iter_substring_items(self, substring):
+        """Return an iterator over the items (``(key,value)`` tuples) of this
+        trie whose keys contain ``substring``."""
+        if not substring:
+            return self.iteritems()
+        return ((key, self[key])
+                for key in self._iter_substring_keys(substring))
+
+    #----- mapping API methods -------------------------------------------------
+
+    def __setitem__(self, key, value):
+        key = self.KeyFactory(key)
+        super(SuffixStringTrie, self).__setitem__(key, value)
+        self._index_key(key)
+
+    def __delitem__(self, key):
+        key = self.KeyFactory(key)
+        super(SuffixStringTrie, self).__delitem__(key)
+        suffixes = self._suffixes
+        for i in range(len(key)):
+            suffix = key[i:]
+            owners = suffixes[suffix]
+            if owners.__class__ is not set:
+                del suffixes[suffix]
+                continue
+            owners.discard(key)
+            if len(owners) == 1:
+                suffixes[suffix] = owners.pop()
+
+    def clear(self):
+        super(SuffixStringTrie, self).clear()
+        self._suffixes = CompressedStringTrie()
+
+    def __getstate__(self):
+        # the index is rebuilt from the keys when unpickled
+        state = super(SuffixStringTrie, self).__getstate__()
+        del state['_suffixes']
+        return state
+
+    def __setstate__(self, state):
+        super(SuffixStringTrie, self).__setstate__(state)
+        self._index_suffixes()
+
+    def _with_root(self, root):
+        clone = super(SuffixStringTrie, self)._with_root(root)
+        clone._index_suffixes()  # pylint: disable=protected-access
+        return clone
+
+    def _index_suffixes(self):
+        """Rebuild the suffix index from the keys of this trie."""
+        self._suffixes = CompressedStringTrie()
+        for key in self.iterkeys():
+            self._index_key(key)
+
+    def _index_key(self, key):
+        """Add the suffixes of ``key`` to the index, unless already there."""
+        suffixes = self._suffixes
+        for i in range(len(key)):
+            suffix = key[i:]
+            owners = suffixes.get(suffix)
+            # a suffix of a single key maps to it, saving a set per suffix
+            if owners is None:
+                suffixes[suffix] = key
+            elif owners.__class__ is set:
+                owners.add(key)
+            elif owners != key:
+                suffixes[suffix] = {owners, key}
+
+    def _iter_substring_keys(self, substring):
+        # walk the nodes of the matching suffixes without forming them
+        suffixes = self._suffixes
+        # pylint: disable=protected-access
+        node = suffixes._find_prefix(suffixes.KeyFactory(substring))[0]
+        if node is None:
+            return
+        seen = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            owners = node.value
+            if owners.__class__ is not set:
+                owners = () if owners is NULL else (owners,)
+            for key in owners:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+            stack.extend(node.children.values())
+
+
+class FrozenTrie(Mapping):
+    """An immutable trie packed into flat arrays.
+
+    The nodes are laid out in breadth-first order so that the children of each
+    node occupy a contiguous range of node indices. The structure is encoded in
+    four :class:`array.array` instances plus the list of values:
+
+    - ``first[i]`` is the index of the first child of node ``i``; its children
+      are the nodes ``first[i]`` to ``first[i+1]-1``.
+    - ``labels[i]`` is the symbol of the edge leading to node ``i``. Symbols are
+      small integers assigned to the distinct key parts; the labels of each
+      node's children are sorted so they can be searched with bisection.
+    - ``value_index[i]`` is the index of node ``i``'s value in ``values``, or
+      -1 if node ``i`` has no value.
+    - ``sizes[i]`` is the number of values in the subtree of node ``i``, so
+      that :meth:`count` takes time proportional to the prefix length.
+
+    A :class:`FrozenTrie` takes a fraction of the memory of the equivalent
+    :class:`Trie` and supports its read-only API. Items are iterated in key
+    part order if the key parts are orderable, otherwise in the order the parts
+    were first encountered.
+
+    The memory is saved at the expense of speed: each step of a lookup
+    searches the packed arrays instead of a dict of children, so lookups are
+    about 5 to 10 times slower than those of a :class:`Trie`, more so for long
+    keys.
+    """
+
+    #: Callable for forming a key from its parts.
+    KeyFactory = tuple
+
+    def __init__(self, *args, **kwargs):
+        """Create a new frozen trie.
+
+        Parameters are the same with ``dict()``.
+        """
+        trie = Trie()
+        trie.KeyFactory = self.KeyFactory
+        trie.update(*args, **kwargs)
+        self._pack(trie)
+
+    @classmethod
+    def from_trie(cls, trie):
+        """Create a new frozen trie with the same items as the :class:`Trie`
+        ``trie``.
+
+        The frozen trie forms its keys with ``trie``'s :attr:`Trie.KeyFactory`.
+        """
+        frozen = cls.__new__(cls)
+        frozen.KeyFactory = trie.KeyFactory
+        frozen._pack(trie)  # pylint: disable=protected-access
+        return frozen
+
+    def _pack(self, trie):
+        # pylint: disable=protected-access
+        root = trie._root
+        parts = set()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            parts.update(node.children)
+            stack.extend(node.children.values())
+        try:
+            symbols = sorted(parts)
+        except TypeError:
+            symbols = list(parts)
+        symbol_ids = {part: symbol for symbol, part in enumerate(symbols)}
+
+        first = array('I', [1])
+        labels = array('I', [0])
+        value_index = array('i')
+        sizes = array('I')
+        values = []
+        queue = deque([root])
+        popleft, append = queue.popleft, queue.append
+        next_index = 1
+        while queue:
+            node = popleft()
+            if node.value is NULL:
+                value_index.append(-1)
+            else:
+                value_index.append(len(values))
+                values.append(node.value)
+            sizes.append(node.count)
+            children = sorted((symbol_ids[part], child)
+                              for part, child in node.children.items())
+            for symbol, child in children:
+                labels.append(symbol)
+                append(child)
+            next_index += len(node.children)
+            first.append(next_index)
+
+        self._symbols = symbols
+        self._symbol_ids = symbol_ids
+        self._first = first
+        self._labels = labels
+        self._value_index = value_index
+        self._sizes = sizes
+        self._values = values
+
+    def save(self, path):
+        """Save this trie to the file ``path``.
+
+        The file can be opened with :meth:`MmapTrie.open`.
+        """
+        dumps = pickle.dumps
+        protocol = pickle.HIGHEST_PROTOCOL
+        value_offsets = array('Q', [0])
+        pickled_values = []
+        size = 0
+        for value in self._values:
+            pickled_value = dumps(value, protocol)
+            pickled_values.append(pickled_value)
+            size += len(pickled_value)
+            value_offsets.append(size)
+        sections = [
+            dumps((self.KeyFactory, self._symbols), protocol),
+            self._first.tobytes(),
+            self._labels.tobytes(),
+            self._value_index.tobytes(),
+            self._sizes.tobytes(),
+            value_offsets.tobytes(),
+            b''.join(pickled_values),
+        ]
+        offsets = []
+        offset = _MMAP_HEADER.size
+        for section in sections:
+            offset += -offset % 8
+            offsets.append(offset)
+            offset += len(section)
+        header = _MMAP_HEADER.pack(
+            _MMAP_MAGIC, _MMAP_BYTEORDER, len(self._labels), len(self._values),
+            offsets[0], len(sections[0]), *offsets[1:])
+        with open(path, 'wb') as f:
+            f.write(header)
+            for offset, section in zip(offsets, sections):
+                f.write(b'\x00' * (offset - f.tell()))
+                f.write(section)
+
+    #----- trie-specific methods -----------------------------------------------
+
+    def count(self, prefix=None):
+        """Return the number of keys in this trie.
+
+        :param prefix: If not None, count only the keys prefixed by ``prefix``.
+        """
+        if prefix is None:
+            return len(self._values)
+        node = self._find(prefix)
+        return self._sizes[node] if node >= 0 else 0
+
+    def longest_prefix(self, key, default=NULL):
+        """Return the longest key in this trie that is a prefix of ``key``.
+
+        If the trie doesn't contain any prefix of ``key``:
+          - if ``default`` is given, return it
+          - otherwise raise ``KeyError``
+        """
+        try:
+            return self.longest_prefix_item(key)[0]
+        except KeyError:
+            if default is not NULL:
+                return default
+            raise
+
+    def longest_prefix_value(self, key, default=NULL):
+        """Return the value associated with the longest key in this trie that is
+        a prefix of ``key``.
+
+        If the trie doesn't contain any prefix of ``key``:
+          - if ``default`` is given, return it
+          - otherwise raise ``KeyError``
+        """
+        longest_prefix_index = -1
+        for _, index in self._iter_prefix_indices(key):
+            longest_prefix_index = index
+        if longest_prefix_index >= 0:
+            return self._values[longest_prefix_index]
+        elif default is not NULL:
+            return default
+        else:
+            raise KeyError
+
+    def longest_prefix_item(self, key, default=NULL):
+        """Return the item (``(key,value)`` tuple) associated with the longest
+        key in this trie that is a prefix of ``key``.
+
+        If the trie doesn't contain any prefix of ``key``:
+          - if ``default`` is given, return it
+          - otherwise raise ``KeyError``
+        """
+        prefix = []
+        longest_prefix_length = longest_prefix_index = -1
+        for prefix_length, index in self._iter_prefix_indices(key, prefix):
+            longest_prefix_length, longest_prefix_index = prefix_length, index
+        if longest_prefix_index >= 0:
+            return (self.KeyFactory(prefix[:longest_prefix_length]),
+                    self._values[longest_prefix_index])
+        elif default is not NULL:
+            return default
+        else:
+            raise KeyError
+
+    def iter_prefixes(self, key):
+        """
+        Return an iterator over the keys of this trie that are prefixes of
+        ``key``.
+        """
+        key_factory = self.KeyFactory
+        prefix = []
+        for prefix_length, _ in self._iter_prefix_indices(key, prefix):
+            yield key_factory(prefix[:prefix_length])
+
+    def iter_prefix_values(self, key):
+        """Return an iterator over the values of this trie that are associated
+        with keys that are prefixes of ``key``.
+        """
+        values = self._values
+        for _, index in self._iter_prefix_indices(key):
+            yield values[index]
+
+    def iter_prefix_items(self, key):
+        """Return an iterator over the items (``(key,value)`` tuples) of this
+        trie that are associated with keys that are prefixes of ``key``.
+        """
+        key_factory = self.KeyFactory
+        values = self._values
+        prefix = []
+        for prefix_length, index in self._iter_prefix_indices(key, prefix):
+            yield (key_factory(prefix[:prefix_length]), values[index])
+
+    #----- extended mapping API methods ----------------------------------------
+
+     # pylint: disable=arguments-differ
+
+    def keys(self, prefix=None):
+        """Return a list of this trie's keys.
+
+        :param prefix: If not None, return only the keys prefixed by ``prefix``.
+        """
+        return list(self.iterkeys(prefix))
+
+    def values(self, prefix=None):
+        """Return a list of this trie's values.
+
+        :param prefix: If not None, return only the values associated with keys
+            prefixed by ``prefix``.
+        """
+        return list(self.itervalues(prefix))
+
+    def items(self, prefix=None):
+        """Return a list of this trie's items (``(key,value)`` tuples).
+
+        :param prefix: If not None, return only the items associated with keys
+            prefixed by ``prefix``.
+        """
+        return list(self.iteritems(prefix))
+
+    def iterkeys(self, prefix=None):
+        """Return an iterator over this trie's keys.
+
+        :param prefix: If not None, yield only the keys prefixed by ``prefix``.
+        """
+        return (key for key, value in self.iteritems(prefix))
+
+    def itervalues(self, prefix=None):
+        """Return an iterator over this trie's values.
+
+        :param prefix: If not None, yield only the values associated with keys
+            prefixed by ``prefix``.
+        """
+        values = self._values
+        root = 0 if prefix is None else self._find(prefix)
+        return (values[index] for _, index in self._iter_subtree(root))
+
+    def iteritems(self, prefix=None):
+        """Return an iterator over this trie's items (``(key,value)`` tuples).
+
+        :param prefix: If not None, yield only the items associated with keys
+            prefixed by ``prefix``.
+        """
+        key_factory = self.KeyFactory
+        values = self._values
+        parts = [] if prefix is None else list(prefix)
+        root = 0 if prefix is None else self._find(parts)
+        return ((key_factory(parts), values[index])
+                for _, index in self._iter_subtree(root, parts))
+
+     # pylint: enable=arguments-differ
+
+    #----- original mapping API methods ----------------------------------------
+
+    def __len__(self):
+        return len(self._values)
+
+    def __bool__(self):
+        return bool(self._values)
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __contains__(self, key):
+        node = self._find(key)
+        return node >= 0 and self._value_index[node] >= 0
+
+    def __getitem__(self, key):
+        node = self._find(key)
+        if node < 0:
+            raise KeyError
+        index = self._value_index[node]
+        if index < 0:
+            raise KeyError
+        return self._values[index]
+
+    def __repr__(self):
+        return '%s({%s})' % (
+            self.__class__.__name__,
+            ', '.join('%r: %r' % t for t in self.iteritems()))
+
+    # the walks down the trie inline the search of a node's children: a
+    # bisection of their labels, skipped for nodes with a single child
+
+    def _find(self, key):
+        symbol_ids, first, labels = self._symbol_ids, self._first, self._labels
+        node = 0
+        for part in key:
+            symbol = symbol_ids.get(part)
+            if symbol is None:
+                return -1
+            start, end = first[node], first[node + 1]
+            if end - start > 1:
+                node = bisect_left(labels, symbol, start, end)
+                if node == end or labels[node] != symbol:
+                    return -1
+            elif start == end or labels[start] != symbol:
+                return -1
+            else:
+                node = start
+        return node
+
+    def _iter_prefix_indices(self, key, prefix=None):
+        """Yield ``(prefix_length, value_index)`` tuples for the keys of this
+        trie that are prefixes of ``key``.
+
+        If ``prefix`` is a list, the parts of ``key`` that have been walked are
+        appended to it.
+        """
+        symbol_ids, first, labels = self._symbol_ids, self._first, self._labels
+        value_index = self._value_index
+        node = 0
+        if value_index[node] >= 0:
+            yield 0, value_index[node]
+        for length, part in enumerate(key, 1):
+            symbol = symbol_ids.get(part)
+            if symbol is None:
+                break
+            start, end = first[node], first[node + 1]
+            if end - start > 1:
+                node = bisect_left(labels, symbol, start, end)
+                if node == end or labels[node] != symbol:
+                    break
+            elif start == end or labels[start] != symbol:
+                break
+            else:
+                node = start
+            if prefix is not None:
+                prefix.append(part)
+            if value_index[node] >= 0:
+                yield length, value_index[node]
+
+    def _iter_subtree(self, root, parts=None):
+        """Yield ``(node, value_index)`` tuples for the nodes with a value in
+        the subtree rooted at ``root``, in depth-first order.
+
+        If ``parts`` is a list that holds the key parts of ``root``, it is
+        updated to hold the key parts of each yielded node.
+        """
+        if root < 0:
+            return
+        first, labels = self._first, self._labels
+        value_index, symbols = self._value_index, self._symbols
+        base_depth = len(parts) if parts is not None else 0
+        stack = [(root, base_depth)]
+        pop = stack.pop
+        while stack:
+            node, depth = pop()
+            if parts is not None and node != root:
+                del parts[depth - 1:]
+                parts.append(symbols[labels[node]])
+            if value_index[node] >= 0:
+                yield node, value_index[node]
+            stack.extend((child, depth + 1) for child in
+                         range(first[node + 1] - 1, first[node] - 1, -1))
+
+
+class _PickledValues:
+    """Read-only sequence of values pickled back to back in a buffer."""
+
+    __slots__ = ('_buffer', '_offsets')
+
+    def __init__(self, buffer, offsets):
+        self._buffer = buffer
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        offsets = self._offsets
+        return pickle.loads(self._buffer[offsets[index]:offsets[index + 1]])
+
+
+class MmapTrie(FrozenTrie):
+    """A :class:`FrozenTrie` that is read directly from a memory-mapped file.
+
+    Files are written with :meth:`FrozenTrie.save` (or :meth:`Trie.save`) and
+    opened with :meth:`open`. Opening a file only reads its header and key
+    part table; the node arrays are accessed in place through the memory map
+    and values are unpickled on access. Processes that open the same file
+    share a single copy of it in the page cache.
+
+    The file stores the arrays in the byte order and item sizes of the machine
+    that wrote it, and can only be opened on a compatible machine.
+    """
+
+    def __init__(self, path):  # pylint: disable=super-init-not-called
+        """Open the trie file at ``path``, as :meth:`open`."""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = _MMAP_HEADER.unpack_from(mapped)
+        except struct.error as exc:
+            mapped.close()
+            raise ValueError('%r is not a trie file' % path) from exc
+        (magic, byteorder, node_count, value_count, meta_offset, meta_size,
+         first_offset, labels_offset, value_index_offset, sizes_offset,
+         value_offsets_offset, values_offset) = header
+        if magic != _MMAP_MAGIC:
+            mapped.close()
+            raise ValueError('%r is not a trie file' % path)
+        if byteorder != _MMAP_BYTEORDER:
+            mapped.close()
+            raise ValueError('%r was written on an incompatible machine' % path)
+
+        def section(offset, fmt, length):
+            size = array(fmt).itemsize * length
+            return buffer[offset:offset + size].cast(fmt)
+
+        buffer = memoryview(mapped)
+        self.KeyFactory, self._symbols = pickle.loads(
+            buffer[meta_offset:meta_offset + meta_size])
+        self._symbol_ids = {part: symbol
+                            for symbol, part in enumerate(self._symbols)}
+        self._first = section(first_offset, 'I', node_count + 1)
+        self._labels = section(labels_offset, 'I', node_count)
+        self._value_index = section(value_index_offset, 'i', node_count)
+        self._sizes = section(sizes_offset, 'I', node_count)
+        self._values = _PickledValues(
+            buffer[values_offset:],
+            section(value_offsets_offset, 'Q', value_count + 1))
+        self._path = path
+        self._mmap = mapped
+
+    @classmethod
+    def open(cls, path):
+        """Open the trie file at ``path``.
+
+        :raises ValueError: If ``path`` is not a trie file or it was written by
+            an incompatible machine.
+        """
+        return cls(path)
+
+    def close(self):
+        """Release the memory map of this trie.
+
+        The trie may no longer be used after it is closed.
+        """
+        # pylint: disable=protected-access
+        for view in (self._first, self._labels, self._value_index,
+                     self._sizes, self._values._offsets, self._values._buffer):
+            view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __reduce__(self):
+        return self.__class__.open, (self._path,)
+
+
+class _StrideNode:
+    """Node of an :class:`IPTrie`, covering 8 bits of the address.
+
+    :ivar entry: The ``(network, value)`` item whose prefix ends at this node,
+        or None.
+    :ivar prefixes: Dict from ``(length, bits)`` tuples to the items whose
+        prefix ends 1 to 7 bits below this node, or None if there are none.
+    :ivar expanded: List of the longest item in ``prefixes`` matching each
+        of the 256 values of the next byte (or None), or None if there are
+        no ``prefixes``.
+    :ivar children: Dict from the next byte to the child nodes.
+    """
+
+    __slots__ = ('entry', 'prefixes', 'expanded', 'children')
+
+    def __init__(self):
+        self.entry = self.prefixes = self.expanded = None
+        self.children = {}
+
+    def __getstate__(self):
+        return self.entry, self.prefixes, self.expanded, self.children
+
+    def __setstate__(self, state):
+        self.entry, self.prefixes, self.expanded, self.children = state
+
+    def expand(self, length, bits):
+        """Refill the entries of :attr:`expanded` covered by the prefix
+        ``(length, bits)``, after it has been added to or removed from
+        :attr:`prefixes`."""
+        prefixes, expanded = self.prefixes, self.expanded
+        start = bits << (8 - length)
+        for byte in range(start, start + (1 << (8 - length))):
+            for prefix_length in range(7, 0, -1):
+                entry = prefixes.get(
+                    (prefix_length, byte >> (8 - prefix_length)))
+                if entry is not None:
+                    break
+            expanded[byte] = entry
+
+    def slots(self, start=0, stop=256, min_length=0):
+        """Return the items and the children of this node whose addresses
+        start at a byte in ``[start, stop)``, in the order of their keys."""
+        slots = []
+        if self.prefixes is not None:
+            for (length, bits), entry in self.prefixes.items():
+                first = bits << (8 - length)
+                if length >= min_length and start <= first < stop:
+                    slots.append((first, length, entry))
+        for byte, child in self.children.items():
+            if start <= byte < stop:
+                slots.append((byte, 8, child))
+        slots.sort(key=itemgetter(0, 1))
+        slots = [slot for _, _, slot in slots]
+        if self.entry is not None and min_length == 0:
+            slots.insert(0, self.entry)
+        return slots
+
+
+class IPTrie(MutableMapping):
+    """A trie of IP networks for longest-prefix matching of addresses.
+
+    Keys are :class:`ipaddress.IPv4Network` and
+    :class:`ipaddress.IPv6Network` objects, or anything that
+    :func:`ipaddress.ip_network` accepts. The prefix queries take addresses
+    or networks and find the networks that contain them:
+
+    >>> t = IPTrie({'10.0.0.0/8': 'a', '10.1.0.0/16': 'b'})
+    >>> t.longest_prefix_value('10.1.2.3')
+    'b'
+    >>> t.longest_prefix(ipaddress.ip_address('10.2.0.1'))
+    IPv4Network('10.0.0.0/8')
+
+    Instead of a node per bit, every node covers a byte of the address: its
+    children are indexed by the next byte, and the prefixes that end within
+    the byte are expanded into a table of the longest one matching each of
+    its 256 values. A lookup therefore takes one step per byte, 4 for IPv4
+    and 16 for IPv6 addresses.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Create a new IP trie.
+
+        Parameters are the same with ``dict()``.
+        """
+        self._roots = {4: _StrideNode(), 6: _StrideNode()}
+        self._len = 0
+        self.update(*args, **kwargs)
+
+    @classmethod
+    def fromkeys(cls, iterable, value=None):
+        """
+        Create a new trie with keys from ``iterable`` and values set to
+        ``value``.
+
+        Parameters are the same with ``dict.fromkeys()``.
+        """
+        trie = cls()
+        for key in iterable:
+            trie[key] = value
+        return trie
+
+    #----- trie-specific methods -----------------------------------------------
+
+    def longest_prefix(self, key, default=NULL):
+        """Return the longest network in this trie that contains the address
+        or network ``key``.
+
+        If the trie doesn't contain any network of ``key``:
+          - if ``default`` is given, return it
+          - otherwise raise ``KeyError``
+        """
+        try:
+            return self.longest_prefix_item(key)[0]
+        except KeyError:
+            if default is not NULL:
+                return default
+            raise
+
+    def longest_prefix_value(self, key, default=NULL):
+        """Return the value associated with the longest network in this trie
+        that contains the address or network ``key``.
+
+        If the trie doesn't contain any network of ``key``:
+          - if ``default`` is given, return it
+          - otherwise raise ``KeyError``
+        """
+        entry = self._longest_entry(*self._query(key))
+        if entry is not None:
+            return entry[1]
+        elif default is not NULL:
+            return default
+        else:
+            raise KeyError
+
+    def longest_prefix_item(self, key, default=NULL):
+        """Return the item (``(network,value)`` tuple) associated with the
+        longest network in this trie that contains the address or network
+        ``key``.
+
+        If the trie doesn't contain any network of ``key``:
+          - if ``default`` is given, return it
+          - otherwise raise ``KeyError``
+        """
+        entry = self._longest_entry(*self._query(key))
+        if entry is not None:
+            return entry
+        elif default is not NULL:
+            return default
+        else:
+            raise KeyError
+
+    def iter_prefixes(self, key):
+        """
+        Return an iterator over the networks of this trie that contain the
+        address or network ``key``, from the widest to the narrowest.
+        """
+        return (network for network, _ in self.iter_prefix_items(key))
+
+    def iter_prefix_values(self, key):
+        """Return an iterator over the values of this trie that are associated
+        with networks that contain the address or network ``key``.
+        """
+        return (value for _, value in self.iter_prefix_items(key))
+
+    def iter_prefix_items(self, key):
+        """Return an iterator over the items (``(network,value)`` tuples) of
+        this trie that are associated with networks that contain the address
+        or network ``key``.
+        """
+        version, packed, length = self._query(key)
+        depth, remainder = divmod(length, 8)
+        node = self._roots[version]
+        for i in range(depth + 1):
+            if node.entry is not None:
+                yield node.entry
+            if i == depth:
+                if not remainder:
+                    break
+                stop = remainder + 1
+            else:
+                stop = 8
+            if node.prefixes is not None:
+                byte = packed[i]
+                for prefix_length in range(1, stop):
+                    entry = node.prefixes.get(
+                        (prefix_length, byte >> (8 - prefix_length)))
+                    if entry is not None:
+                        yield entry
+            if i < depth:
+                node = node.children.get(packed[i])
+                if node is None:
+                    break
+
+    #----- extended mapping API methods ----------------------------------------
+
+     # pylint: disable=arguments-differ
+
+    def keys(self, prefix=None):
+        """Return a list of this trie's networks.
+
+        :param prefix: If not None, return only the subnets of the network
+            ``prefix``.
+        """
+        return list(self.iterkeys(prefix))
+
+    def values(self, prefix=None):
+        """Return a list of this trie's values.
+
+        :param prefix: If not None, return only the values associated with
+            subnets of the network ``prefix``.
+        """
+        return list(self.itervalues(prefix))
+
+    def items(self, prefix=None):
+        """Return a list of this trie's items (``(network,value)`` tuples).
+
+        :param prefix: If not None, return only the items associated with
+            subnets of the network ``prefix``.
+        """
+        return list(self.iteritems(prefix))
+
+    def iterkeys(self, prefix=None):
+        """Return an iterator over this trie's networks.
+
+        :param prefix: If not None, yield only the subnets of the network
+            ``prefix``.
+        """
+        return (key for key, value in self.iteritems(prefix))
+
+    def itervalues(self, prefix=None):
+        """Return an iterator over this trie's values.
+
+        :param prefix: If not None, yield only the values associated with
+            subnets of the network ``prefix``.
+        """
+        return (value for key, value in self.iteritems(prefix))
+
+    def iteritems(self, prefix=None):
+        """Return an iterator over this trie's items (``(network,value)``
+        tuples), IPv4 networks first and in address order.
+
+        :param prefix: If not None, yield only the items associated with
+            subnets of the network ``prefix``.
+        """
+        if prefix is None:
+            return chain(self._iter_subtree(self._roots[4].slots()),
+                         self._iter_subtree(self._roots[6].slots()))
+        network = ipaddress.ip_network(prefix, strict=False)
+        depth, length = divmod(network.prefixlen, 8)
+        packed = network.network_address.packed
+        node = self._roots[network.version]
+        for byte in packed[:depth]:
+            node = node.children.get(byte)
+            if node is None:
+                return iter(())
+        if not length:
+            return self._iter_subtree(node.slots())
+        start = packed[depth]
+        return self._iter_subtree(node.slots(start, start + (1 << (8 - length)),
+                                              length))
+
+     # pylint: enable=arguments-differ
+
+    #----- original mapping API methods ----------------------------------------
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __contains__(self, key):
+        try:
+            return self._find(key)[1] is not None
+        except ValueError:
+            return False
+
+    def __getitem__(self, key):
+        try:
+            entry = self._find(key)[1]
+        except ValueError:
+            entry = None
+        if entry is None:
+            raise KeyError(key)
+        return entry[1]
+
+    def __setitem__(self, key, value):
+        network = ipaddress.ip_network(key)
+        depth, length = divmod(network.prefixlen, 8)
+        packed = network.network_address.packed
+        node = self._roots[network.version]
+        for byte in packed[:depth]:
+            children = node.children
+            node = children.get(byte)
+            if node is None:
+                node = children[byte] = _StrideNode()
+        entry = (network, value)
+        if not length:
+            if node.entry is None:
+                self._len += 1
+            node.entry = entry
+            return
+        if node.prefixes is None:
+            node.prefixes, node.expanded = {}, [None] * 256
+        bits = packed[depth] >> (8 - length)
+        if (length, bits) not in node.prefixes:
+            self._len += 1
+        node.prefixes[length, bits] = entry
+        node.expand(length, bits)
+
+    def __delitem__(self, key):
+        try:
+            network = ipaddress.ip_network(key)
+        except ValueError:
+            raise KeyError(key) from None
+        depth, length = divmod(network.prefixlen, 8)
+        packed = network.network_address.packed
+        node = self._roots[network.version]
+        path = []
+        for byte in packed[:depth]:
+            path.append((node, byte))
+            node = node.children.get(byte)
+            if node is None:
+                raise KeyError(key)
+        if not length:
+            if node.entry is None:
+                raise KeyError(key)
+            node.entry = None
+        else:
+            bits = packed[depth] >> (8 - length)
+            if node.prefixes is None or (length, bits) not in node.prefixes:
+                raise KeyError(key)
+            del node.prefixes[length, bits]
+            if node.prefixes:
+                node.expand(length, bits)
+            else:
+                node.prefixes = node.expanded = None
+        self._len -= 1
+        # prune the nodes left empty, children before parents
+        for parent, byte in reversed(path):
+            if node.entry is not None or node.prefixes is not None or \
+                    node.children:
+                break
+            del parent.children[byte]
+            node = parent
+
+    def clear(self):
+        self._roots = {4: _StrideNode(), 6: _StrideNode()}
+        self._len = 0
+
+    def copy(self):
+        return self.__class__(self.iteritems())
+
+    def __repr__(self):
+        return '%s({%s})' % (
+            self.__class__.__name__,
+            ', '.join('%r: %r' % t for t in self.iteritems()))
+
+    def _find(self, key):
+        """Return the node of the network ``key`` and its item, or None if it
+        is not in this trie."""
+        network = ipaddress.ip_network(key)
+        depth, length = divmod(network.prefixlen, 8)
+        packed = network.network_address.packed
+        node = self._roots[network.version]
+        for byte in packed[:depth]:
+            node = node.children.get(byte)
+            if node is None:
+                return None, None
+        if not length:
+            return node, node.entry
+        if node.prefixes is None:
+            return node, None
+        return node, node.prefixes.get((length, packed[depth] >> (8 - length)))
+
+    def _longest_entry(self, version, packed, length):
+        """Return the item of the longest network that contains the first
+        ``length`` bits of ``packed``, or None."""
+        node = self._roots[version]
+        longest = node.entry
+        depth, length = divmod(length, 8)
+        for byte in packed if depth == len(packed) else packed[:depth]:
+            expanded = node.expanded
+            if expanded is not None and expanded[byte] is not None:
+                longest = expanded[byte]
+            node = node.children.get(byte)
+            if node is None:
+                return longest
+            if node.entry is not None:
+                longest = node.entry
+        if length and node.prefixes is not None:
+            byte = packed[depth]
+            for prefix_length in range(length, 0, -1):
+                entry = node.prefixes.get(
+                    (prefix_length, byte >> (8 - prefix_length)))
+                if entry is not None:
+                    return entry
+        return longest
+
+    @staticmethod
+    def _query(key):
+        """Return the IP version, the packed address and the prefix length of
+        the address or network ``key``."""
+        address_type = _IP_ADDRESS_TYPES.get(key.__class__)
+        if address_type is not None:
+            return address_type[0], key.packed, address_type[1]
+        if not isinstance(key, (ipaddress.IPv4Network,
+                                ipaddress.IPv6Network)):
+            if not isinstance(key, str) or '/' not in key:
+                key = ipaddress.ip_address(key)
+                return key.version, key.packed, key.max_prefixlen
+            key = ipaddress.ip_network(key, strict=False)
+        return key.version, key.network_address.packed, key.prefixlen
+
+    @staticmethod
+    def _iter_subtree(slots):
+        stack = [iter(slots)]
+        while stack:
+            for slot in stack[-1]:
+                if slot.__class__ is tuple:
+                    yield slot
+                else:
+                    stack.append(iter(slot.slots()))
+                    break
+            else:
+                stack.pop()
+
+
+class AhoCorasick:
+    """An Aho-Corasick automaton that finds all the occurrences of the keys of
+    a trie in a text in a single pass.
+
+    The automaton is a snapshot of the trie: its states are the trie's nodes,
+    numbered in breadth-first order, with a goto mapping per state plus a
+    failure and an output link. The failure link of a state points to the
+    state of its longest proper suffix that is also a prefix of a key; the
+    output link points to the nearest state along the failure links that ends
+    a key. Scanning a text of ``n`` parts takes ``O(n + m)`` time for ``m``
+    matches, independently of the number and length of the keys.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Create a new automaton for string keys.
+
+        Parameters are the same with ``dict()``. Use :meth:`from_trie` for other
+        kinds of keys.
+        """
+        self._build(StringTrie(*args, **kwargs))
+
+    @classmethod
+    def from_trie(cls, trie):
+        """Create a new automaton for the keys and values of the :class:`Trie`
+        ``trie``.
+
+        The automaton forms its keys with ``trie``'s :attr:`Trie.KeyFactory`.
+        Later changes to ``trie`` do not affect the automaton.
+        """
+        automaton = cls.__new__(cls)
+        automaton._build(trie)  # pylint: disable=protected-access
+        return automaton
+
+    def __len__(self):
+        """Return the number of keys of this automaton."""
+        return self._size
+
+    def scan(self, text):
+        """Return an iterator over the ``(start, end, key, value)`` tuples of
+        all the occurrences of the keys of this automaton in ``text``, so that
+        ``text[start:end] == key``.
+
+        ``text`` can be any iterable of key parts. Occurrences are yielded in
+        increasing order of ``end`` and, for the same ``end``, from the longest
+        to the shortest. Occurrences may overlap. The empty key is ignored.
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        depth, keys, values = self._depth, self._keys, self._values
+        state = 0
+        for end, part in enumerate(text, 1):
+            transitions = goto[state]
+            while part not in transitions and state:
+                state = fail[state]
+                transitions = goto[state]
+            state = transitions.get(part, 0)
+            match = state if values[state] is not NULL else output[state]
+            while match:
+                yield (end - depth[match], end, keys[match], values[match])
+                match = output[match]
+
+    def _build(self, trie):
+        # pylint: disable=protected-access
+        goto, fail, output, depth = [{}], [0], [0], [0]
+        keys, values = [None], [NULL]
+        # the parent and the key part of each state, to form the keys
+        parents, parts = [0], [None]
+        queue = deque([trie._root])
+        state = 0
+        while queue:
+            node = queue.popleft()
+            transitions = goto[state]
+            for part, child in node.children.items():
+                child_state = len(goto)
+                transitions[part] = child_state
+                # follow the failure links of this state to find the longest
+                # suffix of the child's key that can be extended by part
+                suffix = fail[state]
+                while part not in goto[suffix] and suffix:
+                    suffix = fail[suffix]
+                suffix = goto[suffix].get(part, 0) if state else 0
+                goto.append({})
+                fail.append(suffix)
+                output.append(suffix if values[suffix] is not NULL
+                              else output[suffix])
+                depth.append(depth[state] + 1)
+                parents.append(state)
+                parts.append(part)
+                keys.append(None)
+                values.append(child.value)
+                queue.append(child)
+            state += 1
+        # form the keys of the states with values, walking up to the root
+        key_factory = trie.KeyFactory
+        for state, value in enumerate(values):
+            if value is not NULL:
+                key = []
+                ancestor = state
+                while ancestor:
+                    key.append(parts[ancestor])
+                    ancestor = parents[ancestor]
+                key.reverse()
+                keys[state] = key_factory(key)
+        self._goto, self._fail, self._output = goto, fail, output
+        self._depth, self._keys, self._values = depth, keys, values
+        self._size = sum(value is not NULL for value in values)
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
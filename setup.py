@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from setuptools import setup
+from setuptools import Extension, setup
 
 setup(
     name='PyTrie',
@@ -20,6 +20,9 @@ setup(
         'Topic :: Software Development :: Libraries :: Python Modules',
     ],
     py_modules=['pytrie'],
+    # optional C accelerator; pytrie falls back to pure Python without it
+    ext_modules=[Extension('_pytrie', ['_pytrie.c'], optional=True)],
+    # needed to unpickle sorted tries pickled by pytrie <= 0.4.0
     install_requires=['sortedcontainers'],
     test_suite='tests',
 )
@@ -11,9 +11,12 @@ try:
 except ImportError:  # Python 3
     # pylint: disable=no-name-in-module
     from collections import UserDict
+import string
 from test import mapping_tests
 
-from pytrie import StringTrie
+from pytrie import StringTrie, CompressedStringTrie, ConcurrentStringTrie, \
+    AlphabetStringTrie, SuffixStringTrie, CachedStringTrie, \
+    InstrumentedStringTrie
 
 
 # pylint: disable=invalid-name
@@ -203,3 +206,29 @@ class TestMappingTrieSubclass(TestMappingTrie):
 
     class type2test(StringTrie):
         pass
+
+
+class TestMappingCompressedTrie(TestMappingTrie):
+    type2test = CompressedStringTrie
+
+
+class TestMappingConcurrentTrie(TestMappingTrie):
+    type2test = ConcurrentStringTrie
+
+
+class TestMappingAlphabetTrie(TestMappingTrie):
+
+    class type2test(AlphabetStringTrie):
+        Alphabet = string.printable
+
+
+class TestMappingSuffixTrie(TestMappingTrie):
+    type2test = SuffixStringTrie
+
+
+class TestMappingCachedTrie(TestMappingTrie):
+    type2test = CachedStringTrie
+
+
+class TestMappingInstrumentedTrie(TestMappingTrie):
+    type2test = InstrumentedStringTrie
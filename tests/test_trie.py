@@ -1,12 +1,25 @@
+import ipaddress
+import os
+import tempfile
 import unittest
-from pytrie import SortedStringTrie
+from pytrie import SortedStringTrie, StringTrie, CompressedStringTrie, \
+    SuffixStringTrie, ScoredStringTrie, ConcurrentStringTrie, \
+    PersistentStringTrie, CachedStringTrie, InstrumentedStringTrie, Trie, \
+    AlphabetStringTrie, BytesTrie, AhoCorasick, IPTrie, ANY, ANY_SEQ, NULL
 
 
-class TestTrie(unittest.TestCase):
+class WordsTrieMixin(object):
+    """Builds ``self.trie`` from ``self.words`` mapped to their indices."""
+
+    # which class is being tested (overwrite in subclasses)
+    type2test = SortedStringTrie
 
     def setUp(self):
         self.words = 'an ant all allot alloy aloe are ate be'.split()
-        self.trie = SortedStringTrie(zip(self.words, range(len(self.words))))
+        self.trie = self.type2test(zip(self.words, range(len(self.words))))
+
+
+class TestTrie(WordsTrieMixin, unittest.TestCase):
 
     def test_longest_prefix(self):
         self.assertEqual(self.trie.longest_prefix('antonym'), 'ant')
@@ -101,6 +114,73 @@ class TestTrie(unittest.TestCase):
         self.assertEqual(self.trie.longest_prefix_value('foo'), '!')
         self.assertEqual(self.trie.longest_prefix_item('foo'), ('', '!'))
 
+    def test_len_count(self):
+        trie = self.trie
+        self.assertEqual(len(trie), 9)
+        self.assertEqual(trie.count(), 9)
+        self.assertEqual(trie.count('al'), 4)
+        self.assertEqual(trie.count('all'), 3)
+        self.assertEqual(trie.count('ann'), 0)
+        trie['all'] = -1
+        trie['alps'] = 10
+        self.assertEqual(len(trie), 10)
+        self.assertEqual(trie.count('al'), 5)
+        del trie['all']
+        del trie['alloy']
+        self.assertEqual(len(trie), 8)
+        self.assertEqual(trie.count('al'), 3)
+        self.assertEqual(trie.count('all'), 1)
+        self.assertRaises(KeyError, trie.__delitem__, 'all')
+        self.assertEqual(len(trie), 8)
+        trie[''] = 0
+        self.assertEqual(trie.count(''), 9)
+        self.assertEqual(len(trie.copy()), 9)
+        trie.clear()
+        self.assertEqual(len(trie), 1)
+
+    def test_from_sorted(self):
+        items = sorted(zip(self.words, range(len(self.words))))
+        trie = SortedStringTrie.from_sorted(items)
+        self.assertEqual(trie, self.trie)
+        self.assertEqual(trie.count('al'), 4)
+        # unsorted input and repeated keys are accepted as well
+        trie = SortedStringTrie.from_sorted(
+            [('b', 1), ('ab', 2), ('b', 3), ('a', 4), ('abc', 5)])
+        self.assertEqual(trie.items(),
+                         [('a', 4), ('ab', 2), ('abc', 5), ('b', 3)])
+        self.assertEqual(trie.count('a'), 3)
+        # keys of any iterable type
+        trie = Trie.from_sorted(
+            [(['a', 'b'], 1), (('a',), 2), (iter('abc'), 3)])
+        self.assertEqual(dict(trie.items()), {
+            ('a',): 2, ('a', 'b'): 1, ('a', 'b', 'c'): 3})
+        self.assertEqual(trie.count(('a', 'b')), 2)
+
+    def test_update_counts(self):
+        trie = SortedStringTrie(self.trie)
+        trie.update([('alp', 10), ('all', 11), ('b', 12), ('alpha', 13)])
+        self.assertEqual(len(trie), 12)
+        self.assertEqual(trie.count('al'), 6)
+        self.assertEqual(trie.count('alp'), 2)
+        self.assertEqual(trie['all'], 11)
+        self.assertRaises(TypeError, trie.update, [('x', 1), ([['y']], 2)])
+        self.assertEqual(trie.count(), len(trie.keys()))
+
+    def test_update_overridden_setitem(self):
+        class UpperTrie(StringTrie):
+            def __setitem__(self, key, value):
+                super(UpperTrie, self).__setitem__(key.upper(), value)
+        self.assertEqual(sorted(UpperTrie(self.trie)),
+                         sorted(word.upper() for word in self.words))
+
+    def test_unpickle_without_counts(self):
+        from pytrie import Node, NULL
+        leaf = Node()
+        leaf.__setstate__((1, {}))
+        root = Node()
+        root.__setstate__((NULL, {'a': leaf}))
+        self.assertEqual(len(root), 1)
+
     def test_pickle(self):
         from pickle import dumps, loads, HIGHEST_PROTOCOL
         for proto in range(HIGHEST_PROTOCOL):
@@ -109,7 +189,908 @@ class TestTrie(unittest.TestCase):
             self.assertTrue(type(self.trie) is type(unpickled))
             self.assertTrue(self.trie is not unpickled)
 
+    def test_deep_keys(self):
+        from pickle import dumps, loads
+        key = 'ab' * 5000
+        trie = StringTrie({key: 1, key[:-1]: 2, key + 'c': 3})
+        items = [(key[:-1], 2), (key, 1), (key + 'c', 3)]
+        self.assertEqual(trie.items(), items)
+        self.assertEqual(trie.values(), [2, 1, 3])
+        self.assertEqual(trie.items(key[:100]), items)
+        self.assertEqual(trie.copy().items(), items)
+        unpickled = loads(dumps(trie))
+        self.assertEqual(unpickled.items(), items)
+        self.assertEqual(unpickled.count(key), 2)
+
+    def test_search_fuzzy(self):
+        trie = SortedStringTrie(self.trie)
+        self.assertEqual(list(trie.search_fuzzy('ant', 0)), [('ant', 1, 0)])
+        self.assertEqual(list(trie.search_fuzzy('alle', 1)),
+                         [('all', 2, 1), ('aloe', 5, 1)])
+        self.assertEqual([key for key, _, _ in trie.search_fuzzy('ale', 2)],
+                         ['all', 'aloe', 'an', 'ant', 'are', 'ate', 'be'])
+        self.assertEqual(list(trie.search_fuzzy('xyz', 1)), [])
+        trie[''] = -1
+        self.assertEqual(list(trie.search_fuzzy('b', 1)),
+                         [('', -1, 1), ('be', 8, 1)])
+
+    def test_match(self):
+        trie = SortedStringTrie(self.trie)
+        self.assertEqual(list(trie.match('a?t')), [('ant', 1)])
+        self.assertEqual([key for key, _ in trie.match('al*')],
+                         ['all', 'allot', 'alloy', 'aloe'])
+        self.assertEqual([key for key, _ in trie.match('*e')],
+                         ['aloe', 'are', 'ate', 'be'])
+        self.assertEqual([key for key, _ in trie.match('a[nr]*')],
+                         ['an', 'ant', 'are'])
+        self.assertEqual([key for key, _ in trie.match('a[!l-n]?')],
+                         ['are', 'ate'])
+        self.assertEqual([key for key, _ in trie.match('*o*')],
+                         ['allot', 'alloy', 'aloe'])
+        self.assertEqual(list(trie.match('a[l')), [])
+        self.assertEqual(list(trie.match('x*')), [])
+        self.assertEqual([key for key, _ in trie.match(['a', ANY, ANY_SEQ])],
+                         ['all', 'allot', 'alloy', 'aloe', 'an', 'ant', 'are',
+                          'ate'])
+
+    def test_match_parts(self):
+        trie = Trie({(1, 2, 3): 'a', (1, 5): 'b', (2,): 'c', (): 'd'})
+        self.assertEqual(sorted(trie.match([1, ANY_SEQ])),
+                         [((1, 2, 3), 'a'), ((1, 5), 'b')])
+        self.assertEqual(list(trie.match([{1, 2}, ANY])), [((1, 5), 'b')])
+        self.assertEqual(list(trie.match([])), [((), 'd')])
+        self.assertEqual(len(list(trie.match([ANY_SEQ]))), 4)
+
+    def test_sorted_insertion_order(self):
+        import random
+        words = self.words + ['alley', 'b', 'ale', 'antonym', 'al']
+        random.Random(0).shuffle(words)
+        trie = SortedStringTrie()
+        for i, word in enumerate(words):
+            trie[word] = i
+        self.assertEqual(trie.keys(), sorted(words))
+        self.assertEqual(trie.keys('al'), sorted(w for w in words
+                                                 if w.startswith('al')))
+        for word in words[::2]:
+            del trie[word]
+        trie['alp'] = trie['a'] = -1
+        expected = sorted(words[1::2] + ['alp', 'a'])
+        self.assertEqual(trie.keys(), expected)
+        self.assertEqual(list(trie), expected)
+        self.assertEqual(trie.values(), [trie[w] for w in expected])
+        self.assertEqual(trie.copy().keys(), expected)
+
+    def test_key_types(self):
+        trie = StringTrie()
+        trie[('a', 'l', 'l')] = 1
+        trie[['a', 'n']] = 2
+        trie[iter('are')] = 3
+        trie[type('S', (str,), {})('ate')] = 4
+        self.assertEqual(trie.items(),
+                         [('all', 1), ('an', 2), ('are', 3), ('ate', 4)])
+        self.assertEqual(trie[iter('an')], 2)
+        self.assertIn(['a', 'r', 'e'], trie)
+        self.assertNotIn(('a', 'r'), trie)
+        self.assertEqual(trie.longest_prefix_value(('a', 'l', 'l', 'y')), 1)
+        self.assertEqual(list(trie.iter_prefix_values(iter('ate'))), [4])
+        self.assertEqual(len(trie), 4)
+
+    def test_wide_chars(self):
+        # characters outside latin-1, including two that share a cache slot
+        keys = ['\u03b1\u03b2', '\u03b1', '\u65e5\u672c', chr(0x3b1 + 1024),
+                '\U0001f600!']
+        trie = StringTrie(zip(keys, range(len(keys))))
+        self.assertEqual([trie[key] for key in keys], list(range(len(keys))))
+        self.assertNotIn(chr(0x3b2 + 1024), trie)
+        self.assertEqual(trie.longest_prefix_value('\u03b1\u03b2\u03b3'), 0)
+        self.assertEqual(list(trie.iter_prefix_values('\u03b1\u03b2')), [1, 0])
+        self.assertEqual(trie.count('\u03b1'), 2)
+
+    def test_iter_prefix_values_lazy(self):
+        trie = StringTrie(all=2, allot=3)
+        values = trie.iter_prefix_values('allot')
+        trie['a'] = 1
+        self.assertEqual(next(values), 1)
+        trie['allo'] = 4
+        self.assertEqual(list(values), [2, 4, 3])
+        values = trie.iter_prefix_values(5)
+        self.assertRaises(TypeError, list, values)
+
     def test_repr(self):
         evaled = eval(repr(self.trie))
         self.assertEqual(evaled, self.trie)
         self.assertEqual(evaled.__class__, self.trie.__class__)
+
+
+class TestBatchLookups(WordsTrieMixin, unittest.TestCase):
+
+    def test_batch_lookups(self):
+        keys = ['alla', 'all', 'al', 'allot', 'b', 'antonym', 'an', '']
+        for keys in keys, sorted(keys):
+            self.assertEqual(self.trie.get_many(keys),
+                             [self.trie.get(key) for key in keys])
+            self.assertEqual(self.trie.get_many(iter(keys), -1),
+                             [self.trie.get(key, -1) for key in keys])
+            self.assertEqual(self.trie.contains_many(keys),
+                             [key in self.trie for key in keys])
+            self.assertEqual(
+                self.trie.longest_prefix_value_many(keys, default=-1),
+                [self.trie.longest_prefix_value(key, -1) for key in keys])
+        self.assertRaises(KeyError, self.trie.longest_prefix_value_many,
+                          ['ant', 'b'])
+        self.assertEqual(self.trie.longest_prefix_value_many([]), [])
+
+
+class TestOrderStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.words = sorted('an ant all allot alloy aloe are ate be'.split())
+        self.trie = SortedStringTrie.fromkeys(self.words)
+
+    def test_nth_rank(self):
+        for i, word in enumerate(self.words):
+            self.assertEqual(self.trie.nth(i), word)
+            self.assertEqual(self.trie.rank(word), i)
+        self.assertEqual(self.trie.nth(-1), 'be')
+        self.assertRaises(IndexError, self.trie.nth, 9)
+        self.assertRaises(IndexError, self.trie.nth, -10)
+        self.assertEqual(self.trie.rank(''), 0)
+        self.assertEqual(self.trie.rank('allow'), 2)
+        self.assertEqual(self.trie.rank('c'), 9)
+
+    def test_irange(self):
+        self.assertEqual(list(self.trie.irange('allot', 'ant')),
+                         ['allot', 'alloy', 'aloe', 'an', 'ant'])
+        self.assertEqual(list(self.trie.irange('allot', 'ant',
+                                               inclusive=(False, False))),
+                         ['alloy', 'aloe', 'an'])
+        self.assertEqual(list(self.trie.irange('alm')), self.words[3:])
+        self.assertEqual(list(self.trie.irange(maximum='all')), ['all'])
+        self.assertEqual(list(self.trie.irange('b', 'a')), [])
+
+    def test_successor_predecessor(self):
+        self.assertEqual(self.trie.successor('all'), 'allot')
+        self.assertEqual(self.trie.successor('allow'), 'alloy')
+        self.assertEqual(self.trie.predecessor('allow'), 'allot')
+        self.assertEqual(self.trie.predecessor('an'), 'aloe')
+        self.assertRaises(KeyError, self.trie.successor, 'be')
+        self.assertRaises(KeyError, self.trie.predecessor, 'all')
+
+
+class LowercaseTrie(AlphabetStringTrie):
+    Alphabet = 'abcdefghijklmnopqrstuvwxyz'
+
+
+class DNATrie(AlphabetStringTrie):
+    Alphabet = 'ACGT'
+
+
+class TestAlphabetTrie(TestTrie):
+
+    type2test = LowercaseTrie
+
+    def test_alphabet(self):
+        trie = DNATrie(GATTACA=1, GAT=2, TAG=3)
+        self.assertEqual(trie.keys(), ['GAT', 'GATTACA', 'TAG'])
+        self.assertEqual(trie.longest_prefix_item('GATTAG'), ('GAT', 2))
+        self.assertRaises(ValueError, trie.__setitem__, 'TAGN', 4)
+        self.assertRaises(ValueError, trie.__setitem__, 'CAU', 4)
+        self.assertNotIn('TAGN', trie)
+        self.assertEqual(len(trie), 3)
+        self.assertEqual(trie.count('C'), 0)
+        del trie['GAT']
+        self.assertEqual(trie.items(prefix='GA'), [('GATTACA', 1)])
+        # pylint: disable=protected-access
+        children = trie._root.children
+        self.assertEqual(list(children), ['G', 'T'])
+        self.assertEqual(children.bitmap, 0b1100)
+        # the dict signatures, keywords included
+        self.assertIs(children.get(key='A', default=None), None)
+        self.assertIs(children.setdefault(key='G'), children['G'])
+
+    def test_bytes(self):
+        trie = BytesTrie({b'abc': 1, b'ab': 2, b'\xff\x00': 3})
+        self.assertEqual(trie.keys(), [b'ab', b'abc', b'\xff\x00'])
+        self.assertEqual(trie.longest_prefix_value(b'abcd'), 1)
+        self.assertEqual(list(trie.iter_prefixes(b'abc')), [b'ab', b'abc'])
+        self.assertRaises(ValueError, trie.__setitem__, 'abc', 1)
+
+
+class TestTrieView(WordsTrieMixin, unittest.TestCase):
+
+    def test_mapping(self):
+        view = self.trie.view('al')
+        self.assertEqual(view.prefix, 'al')
+        self.assertEqual(len(view), 4)
+        self.assertEqual(list(view), ['all', 'allot', 'alloy', 'aloe'])
+        self.assertEqual(view.items(), self.trie.items('al'))
+        self.assertIn('allot', view)
+        self.assertNotIn('an', view)
+        self.assertNotIn('alp', view)
+        self.assertEqual(view['aloe'], 5)
+        self.assertRaises(KeyError, view.__getitem__, 'an')
+        self.assertEqual(view.get('an', -1), -1)
+        self.assertEqual(len(self.trie.view()), len(self.trie))
+        self.assertEqual(len(self.trie.view('x')), 0)
+        self.assertEqual(self.trie.view('x').keys(1), [])
+
+    def test_live(self):
+        view = self.trie.view('al')
+        self.trie['alp'] = 9
+        del self.trie['all']
+        self.assertEqual(view.keys(), ['allot', 'alloy', 'aloe', 'alp'])
+        for key in view.keys():
+            del self.trie[key]
+        self.assertEqual(len(view), 0)
+        self.trie['alpha'] = 10
+        self.assertEqual(view.items(), [('alpha', 10)])
+
+    def test_narrowing(self):
+        view = self.trie.view('a').view('llo')
+        self.assertEqual(view.prefix, 'allo')
+        self.assertEqual(view.keys(), ['allot', 'alloy'])
+        self.assertEqual(self.trie.view('a').view('x').keys(), [])
+
+    def test_pagination(self):
+        view = self.trie.view('a')
+        keys = view.keys()
+        for start in range(len(keys) + 2):
+            for stop in range(len(keys) + 2):
+                self.assertEqual(view.keys(start, stop), keys[start:stop])
+                self.assertEqual(view.values(start, stop),
+                                 [self.trie[key] for key in keys[start:stop]])
+        self.assertEqual(list(view.iteritems(stop=2)),
+                         [('all', 2), ('allot', 3)])
+        self.assertRaises(ValueError, view.keys, -1)
+
+
+class TestScoredTrie(unittest.TestCase):
+
+    def setUp(self):
+        self.scores = {'an': 5, 'ant': 9, 'all': 2, 'allot': 7, 'alloy': 1,
+                       'aloe': 6, 'are': 3, 'ate': 4, 'be': 8}
+        self.trie = ScoredStringTrie(self.scores)
+
+    def assertTopK(self, trie, scores):
+        for prefix in '', 'a', 'al', 'all', 'b', 'x':
+            for k in 0, 1, 2, 5, 20:
+                expected = sorted((score for key, score in scores.items()
+                                   if key.startswith(prefix)), reverse=True)
+                top = trie.top_k(prefix, k)
+                # items with equal scores may come in any order
+                self.assertEqual([score for _, score in top], expected[:k])
+                for key, score in top:
+                    self.assertTrue(key.startswith(prefix))
+                    self.assertEqual(scores[key], score)
+
+    def test_top_k(self):
+        self.assertEqual(self.trie.top_k('a', 3),
+                         [('ant', 9), ('allot', 7), ('aloe', 6)])
+        self.assertEqual(self.trie.top_k(None, 1), [('ant', 9)])
+        self.assertTopK(self.trie, self.scores)
+        self.assertEqual(StringTrie(self.scores).top_k('al', 2),
+                         [('allot', 7), ('aloe', 6)])
+
+    def test_key(self):
+        self.assertEqual(self.trie.top_k('al', 2, key=lambda score: -score),
+                         [('alloy', 1), ('all', 2)])
+
+    def test_updates(self):
+        import random
+        rng = random.Random(0)
+        scores = dict(self.scores)
+        for _ in range(200):
+            key = ''.join(rng.choice('abln') for _ in range(rng.randint(0, 4)))
+            if key in scores and rng.random() < 0.4:
+                del self.trie[key]
+                del scores[key]
+            else:
+                self.trie[key] = scores[key] = rng.randint(-10, 10)
+            self.assertTopK(self.trie, scores)
+        self.assertTopK(self.trie.copy(), scores)
+        from pickle import dumps, loads
+        self.assertTopK(loads(dumps(self.trie)), scores)
+
+    def test_score_key(self):
+        from operator import itemgetter
+
+        class PairTrie(ScoredStringTrie):
+            ScoreKey = itemgetter(0)
+
+        trie = PairTrie((key, (score, key)) for key, score in self.scores.items())
+        self.assertEqual(trie.top_k('a', 2),
+                         [('ant', (9, 'ant')), ('allot', (7, 'allot'))])
+        trie['alp'] = (10, 'alp')
+        self.assertEqual(trie.top_k('al', 1), [('alp', (10, 'alp'))])
+
+
+class TestConcurrentTrie(WordsTrieMixin, unittest.TestCase):
+
+    type2test = ConcurrentStringTrie
+
+    def test_snapshots(self):
+        iterator = self.trie.iteritems('al')
+        snapshot = self.trie.copy()
+        view = self.trie.view('al')
+        del self.trie['allot']
+        del self.trie['all']
+        self.trie['alp'] = 10
+        self.trie.update(an=-1, alpha=11)
+        self.assertEqual(sorted(iterator), [('all', 2), ('allot', 3),
+                                            ('alloy', 4), ('aloe', 5)])
+        self.assertEqual(sorted(snapshot.items()),
+                         sorted(zip(self.words, range(len(self.words)))))
+        self.assertEqual(sorted(view.keys()), ['alloy', 'aloe', 'alp', 'alpha'])
+        self.assertEqual(self.trie['an'], -1)
+        self.assertEqual(len(self.trie), 9)
+        self.assertEqual(self.trie.count('al'), 4)
+        snapshot.clear()
+        self.assertEqual(len(self.trie), 9)
+
+    def test_threads(self):
+        import threading
+        errors = []
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                # every update sets all values to the same number
+                if len(set(self.trie.values())) != 1:
+                    errors.append(self.trie.items())
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        self.trie.update(dict.fromkeys(self.words, 0))
+        for reader in readers:
+            reader.start()
+        for value in range(1, 200):
+            self.trie.update(dict.fromkeys(self.trie.keys(), value))
+            self.trie['b' * (value % 7)] = value
+            del self.trie['b' * (value % 7)]
+        done.set()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(errors, [])
+
+
+class TestPersistentTrie(WordsTrieMixin, unittest.TestCase):
+
+    type2test = PersistentStringTrie
+
+    def test_updates(self):
+        trie = self.trie.set('alp', 10).set('an', -1).delete('all')
+        self.assertEqual(trie['alp'], 10)
+        self.assertEqual(trie['an'], -1)
+        self.assertNotIn('all', trie)
+        self.assertEqual(len(trie), 9)
+        self.assertEqual(trie.count('al'), 4)
+        self.assertEqual(sorted(self.trie.items()),
+                         sorted(zip(self.words, range(len(self.words)))))
+        self.assertRaises(KeyError, self.trie.delete, 'alp')
+        self.assertEqual(self.trie.set_many({'be': 0}, bee=1)['bee'], 1)
+        self.assertIs(self.trie.copy(), self.trie)
+
+    def test_sharing(self):
+        # pylint: disable=protected-access
+        trie = self.trie.set('bet', 10)
+        self.assertIsNot(trie._root, self.trie._root)
+        self.assertIs(trie._root.children['a'], self.trie._root.children['a'])
+
+    def test_immutable(self):
+        self.assertRaises(TypeError, self.trie.__setitem__, 'x', 1)
+        self.assertRaises(TypeError, self.trie.__delitem__, 'an')
+        self.assertRaises(TypeError, self.trie.update, x=1)
+        self.assertRaises(TypeError, self.trie.pop, 'an')
+        self.assertRaises(TypeError, self.trie.clear)
+        self.assertEqual(len(self.trie), len(self.words))
+
+    def test_versions(self):
+        import random
+        rng = random.Random(0)
+        versions = [(PersistentStringTrie(), {})]
+        for i in range(300):
+            trie, items = versions[rng.randrange(len(versions))]
+            items = dict(items)
+            key = ''.join(rng.choice('abc') for _ in range(rng.randint(0, 4)))
+            if key in items and rng.random() < 0.4:
+                trie = trie.delete(key)
+                del items[key]
+            else:
+                trie = trie.set(key, i)
+                items[key] = i
+            versions.append((trie, items))
+        for trie, items in versions:
+            self.assertEqual(dict(trie.items()), items)
+            self.assertEqual(len(trie), len(items))
+
+
+class TestSetAlgebra(unittest.TestCase):
+
+    def setUp(self):
+        self.trie = StringTrie(an=0, ant=1, all=2, allot=3, be=4)
+        self.other = {'ant': 10, 'allot': 3, 'are': 12, 'be': 4, 'bee': 14}
+
+    def test_merge(self):
+        merged = self.trie.merge(self.other)
+        self.assertIsInstance(merged, StringTrie)
+        expected = dict(self.trie.items())
+        expected.update(self.other)
+        self.assertEqual(dict(merged.items()), expected)
+        self.assertEqual(merged.count('a'), 5)
+        merged = self.trie.merge(self.other, resolve=lambda a, b: a + b)
+        self.assertEqual(merged['ant'], 11)
+        self.assertEqual(merged['an'], 0)
+        self.assertEqual(merged['bee'], 14)
+        self.assertEqual(len(self.trie), 5)
+
+    def test_intersection_difference(self):
+        self.assertEqual(dict(self.trie.intersection(self.other).items()),
+                         {'ant': 1, 'allot': 3, 'be': 4})
+        difference = self.trie.difference(self.other)
+        self.assertEqual(dict(difference.items()), {'an': 0, 'all': 2})
+        self.assertEqual(difference.count('al'), 1)
+        # pylint: disable=protected-access
+        self.assertNotIn('b', difference._root.children)
+
+    def test_diff(self):
+        self.assertEqual(sorted(self.trie.diff(self.other)), [
+            ('all', 2, NULL), ('an', 0, NULL), ('ant', 1, 10),
+            ('are', NULL, 12), ('bee', NULL, 14)])
+        self.assertEqual(list(self.trie.diff(self.trie.copy())), [])
+
+    def test_random(self):
+        import random
+        rng = random.Random(0)
+        for _ in range(50):
+            items = [{''.join(rng.choice('abc')
+                              for _ in range(rng.randint(0, 4))): i
+                      for i in range(rng.randint(0, 20))} for _ in range(2)]
+            trie, other = StringTrie(items[0]), StringTrie(items[1])
+            for result in (trie.merge(other), trie.intersection(other),
+                           trie.difference(other)):
+                self.assertEqual(len(result), len(list(result.keys())))
+            expected = dict(items[0])
+            expected.update(items[1])
+            self.assertEqual(dict(trie.merge(other).items()), expected)
+            self.assertEqual(
+                dict(trie.intersection(other).items()),
+                {k: v for k, v in items[0].items() if k in items[1]})
+            self.assertEqual(
+                dict(trie.difference(other).items()),
+                {k: v for k, v in items[0].items() if k not in items[1]})
+            self.assertEqual(
+                sorted(trie.diff(other), key=lambda t: t[0]),
+                sorted(((k, items[0].get(k, NULL), items[1].get(k, NULL))
+                        for k in set(items[0]) | set(items[1])
+                        if items[0].get(k, NULL) != items[1].get(k, NULL)),
+                       key=lambda t: t[0]))
+
+    def test_sharing(self):
+        # pylint: disable=protected-access
+        trie = PersistentStringTrie(self.trie)
+        other = trie.set('bee', 14)
+        merged = trie.merge(other)
+        self.assertIs(merged._root.children['a'], trie._root.children['a'])
+        self.assertEqual(list(trie.diff(other)), [('bee', NULL, 14)])
+        # plain tries never share their nodes
+        merged = self.trie.merge(trie)
+        self.assertIsNot(merged._root.children['a'],
+                         trie._root.children['a'])
+        merged['alpha'] = 5
+        self.assertNotIn('alpha', trie)
+
+
+class TestIPTrie(unittest.TestCase):
+
+    def setUp(self):
+        self.trie = IPTrie({'0.0.0.0/0': 'default', '10.0.0.0/8': 'a',
+                            '10.1.0.0/16': 'b', '10.1.2.0/23': 'c',
+                            '10.1.2.3/32': 'd', '2001:db8::/32': 'e'})
+
+    def test_longest_prefix(self):
+        trie = self.trie
+        self.assertEqual(trie.longest_prefix_value('10.1.2.3'), 'd')
+        self.assertEqual(trie.longest_prefix_value('10.1.3.4'), 'c')
+        self.assertEqual(trie.longest_prefix_value('10.1.4.4'), 'b')
+        self.assertEqual(trie.longest_prefix_value('10.200.0.1'), 'a')
+        self.assertEqual(trie.longest_prefix_value('192.0.2.1'), 'default')
+        self.assertEqual(trie.longest_prefix_item('2001:db8::1'),
+                         (ipaddress.ip_network('2001:db8::/32'), 'e'))
+        self.assertEqual(trie.longest_prefix(ipaddress.ip_network(
+            '10.1.2.0/24')), ipaddress.ip_network('10.1.2.0/23'))
+        self.assertRaises(KeyError, trie.longest_prefix, '2001:db9::1')
+        self.assertEqual(trie.longest_prefix_value('::1', default=-1), -1)
+        self.assertEqual(list(trie.iter_prefix_values('10.1.2.3')),
+                         ['default', 'a', 'b', 'c', 'd'])
+
+    def test_mapping(self):
+        trie = self.trie
+        self.assertEqual(len(trie), 6)
+        self.assertEqual(trie[ipaddress.ip_network('10.1.0.0/16')], 'b')
+        self.assertIn('10.1.2.3', trie)
+        self.assertNotIn('10.1.2.0/24', trie)
+        self.assertRaises(ValueError, trie.__setitem__, '10.1.2.3/8', 'x')
+        self.assertEqual(trie.keys('10.1.0.0/16'), [
+            ipaddress.ip_network(network)
+            for network in ('10.1.0.0/16', '10.1.2.0/23', '10.1.2.3/32')])
+        del trie['10.1.2.0/23']
+        self.assertEqual(trie.longest_prefix_value('10.1.3.4'), 'b')
+        self.assertRaises(KeyError, trie.__delitem__, '10.1.2.0/23')
+        self.assertEqual(trie.copy(), trie)
+
+    def test_brute_force(self):
+        import random
+        rng = random.Random(0)
+        trie, networks = IPTrie(), {}
+        for i in range(300):
+            network = ipaddress.ip_network(
+                (rng.getrandbits(4) << 28, rng.randint(0, 32)), strict=False)
+            if network in networks and rng.random() < 0.3:
+                del trie[network]
+                del networks[network]
+            else:
+                trie[network] = networks[network] = i
+        self.assertEqual(trie.items(), sorted(networks.items()))
+        for _ in range(300):
+            address = ipaddress.ip_address(rng.getrandbits(4) << 28 |
+                                           rng.getrandbits(28))
+            self.assertEqual(
+                list(trie.iter_prefixes(address)),
+                sorted((network for network in networks if address in network),
+                       key=lambda network: network.prefixlen))
+
+
+class TestCachedTrie(WordsTrieMixin, unittest.TestCase):
+
+    type2test = CachedStringTrie
+
+    def test_cache(self):
+        trie = self.trie
+        for _ in range(3):
+            self.assertEqual(trie.longest_prefix('allotment'), 'allot')
+            self.assertEqual(trie.longest_prefix_value('allotment'), 3)
+            self.assertEqual(list(trie.iter_prefixes('allotment')),
+                             ['all', 'allot'])
+            self.assertEqual(trie['ant'], 1)
+            self.assertNotIn('ants', trie)
+        self.assertEqual(trie.cache_info().hits, 11)
+        self.assertEqual(trie.cache_info().misses, 4)
+        # unhashable keys are not cached
+        self.assertEqual(trie[list('ant')], 1)
+        self.assertEqual(trie.cache_info().currsize, 4)
+        trie.cache_clear()
+        self.assertEqual(trie.cache_info().currsize, 0)
+
+    def test_invalidation(self):
+        trie = self.trie
+        self.assertEqual(trie.longest_prefix_value('allotment'), 3)
+        trie['allotm'] = 10
+        self.assertEqual(trie.longest_prefix_value('allotment'), 10)
+        del trie['allotm']
+        self.assertEqual(trie.longest_prefix_value('allotment'), 3)
+        trie.update(allotme=11)
+        self.assertEqual(trie.longest_prefix_value('allotment'), 11)
+        self.assertIn('be', trie)
+        trie.pop('be')
+        self.assertNotIn('be', trie)
+        trie.clear()
+        self.assertRaises(KeyError, trie.longest_prefix, 'allotment')
+
+    def test_copy(self):
+        trie = self.trie
+        self.assertEqual(trie['be'], 8)
+        clone = trie.copy()
+        clone['be'] = 0
+        self.assertEqual(trie['be'], 8)
+        self.assertEqual(clone['be'], 0)
+        self.assertEqual(clone.cache_info().hits, 0)
+
+
+class TestInstrumentation(WordsTrieMixin, unittest.TestCase):
+
+    type2test = InstrumentedStringTrie
+
+    def test_stats(self):
+        stats = self.trie.stats()
+        self.assertEqual(stats.nodes, 17)
+        self.assertEqual(stats.leaves, 7)
+        self.assertEqual(stats.valueless, 8)
+        self.assertEqual(stats.single_child, 6)
+        self.assertEqual(stats.depths, {0: 1, 1: 2, 2: 5, 3: 5, 4: 2, 5: 2})
+        self.assertEqual(stats.fanouts, {0: 7, 1: 6, 2: 3, 4: 1})
+        self.assertEqual(sum(stats.depths.values()), stats.nodes)
+        self.assertGreater(stats.memory, 0)
+        self.assertEqual(Trie().stats().nodes, 1)
+
+    def test_counters(self):
+        trie = self.trie
+        self.assertEqual(trie.counters['setitem'], 9)
+        trie.counters.clear()
+        self.assertEqual(trie['allot'], 3)
+        self.assertNotIn('alp', trie)
+        self.assertEqual(trie.counters['find'], 2)
+        self.assertEqual(trie.counters['find_nodes'], 6 + 3)
+        self.assertEqual(len(trie.keys('al')), 4)
+        self.assertEqual(trie.counters['traverse'], 1)
+        self.assertEqual(trie.counters['traverse_nodes'], 3 + 6)
+        self.assertRaises(KeyError, trie.__delitem__, 'bee')
+        del trie['be']
+        self.assertEqual(trie.counters['delitem'], 2)
+        self.assertEqual(trie.counters['delitem_nodes'], 3 + 3)
+
+    def test_prefix_counters(self):
+        trie = self.trie
+        trie.counters.clear()
+        self.assertEqual(trie.longest_prefix_value('allowed'), 2)
+        self.assertEqual(trie.longest_prefix('ants'), 'ant')
+        self.assertEqual(trie.longest_prefix_item('x', None), None)
+        self.assertEqual(list(trie.iter_prefixes('anthem')), ['an', 'ant'])
+        self.assertEqual(list(trie.iter_prefix_values('ant')), [0, 1])
+        self.assertEqual(list(trie.iter_prefix_items('be')), [('be', 8)])
+        self.assertEqual(trie.counters['prefix'], 6)
+        self.assertEqual(trie.counters['prefix_nodes'], 5 + 4 + 1 + 4 + 4 + 3)
+        self.assertEqual(trie.counters['find'], 0)
+
+    def test_hook(self):
+        calls = []
+        self.trie.hook = lambda *args: calls.append(args)
+        self.trie['alp'] = 10
+        self.trie.get('alloy')
+        self.assertEqual(calls, [('setitem', 'alp', 4), ('find', 'alloy', 6)])
+        self.assertEqual(self.trie.copy().counters, {})
+
+    def test_copy(self):
+        import copy
+        self.trie['alp'] = [10]
+        hook = self.trie.hook = lambda *args: None
+        for clone in (self.trie.copy(), copy.copy(self.trie),
+                      copy.deepcopy(self.trie)):
+            self.assertEqual(clone.counters, {})
+            self.assertIsNot(clone.counters, self.trie.counters)
+            self.assertEqual(clone, self.trie)
+            self.assertIs(clone.hook, hook)
+            clone['be'] = -1
+            self.assertEqual(self.trie['be'], 8)
+        self.assertIsNot(clone['alp'], self.trie['alp'])
+
+
+class TestAhoCorasick(unittest.TestCase):
+
+    def test_scan(self):
+        automaton = AhoCorasick(he=1, she=2, his=3, hers=4)
+        self.assertEqual(len(automaton), 4)
+        self.assertEqual(list(automaton.scan('ushers')),
+                         [(1, 4, 'she', 2), (2, 4, 'he', 1), (2, 6, 'hers', 4)])
+        self.assertEqual(list(automaton.scan('ahishe')),
+                         [(1, 4, 'his', 3), (3, 6, 'she', 2), (4, 6, 'he', 1)])
+        self.assertEqual(list(automaton.scan('')), [])
+        self.assertEqual(list(AhoCorasick().scan('abc')), [])
+
+    def test_brute_force(self):
+        import random
+        rng = random.Random(0)
+        for _ in range(100):
+            keys = {''.join(rng.choice('abc') for _ in range(rng.randint(1, 4)))
+                    for _ in range(rng.randint(1, 10))}
+            trie = StringTrie.fromkeys(keys, 0)
+            text = ''.join(rng.choice('abcd') for _ in range(30))
+            expected = [(start, end, text[start:end], 0)
+                        for end in range(len(text) + 1)
+                        for start in range(end)
+                        if text[start:end] in keys]
+            self.assertEqual(list(trie.build_automaton().scan(text)), expected)
+
+    def test_snapshot(self):
+        trie = Trie({(1, 2): 'x', (2,): 'y'})
+        automaton = AhoCorasick.from_trie(trie)
+        trie[(1,)] = 'z'
+        self.assertEqual(list(automaton.scan(iter([1, 2, 1]))),
+                         [(0, 2, (1, 2), 'x'), (1, 2, (2,), 'y')])
+
+    def test_long_keys(self):
+        key = 'a' * 5000
+        automaton = AhoCorasick({key: 1, key[:10]: 2, 'b': 3})
+        self.assertEqual(list(automaton.scan(key + 'a')), [
+            (start, start + 10, key[:10], 2) for start in range(4990)] + [
+            (0, 5000, key, 1), (4990, 5000, key[:10], 2),
+            (1, 5001, key, 1), (4991, 5001, key[:10], 2)])
+
+
+class TestSuffixStringTrie(WordsTrieMixin, unittest.TestCase):
+
+    type2test = SuffixStringTrie
+
+    def test_substring(self):
+        trie = self.trie
+        self.assertEqual(sorted(trie.iter_substring_keys('ll')),
+                         ['all', 'allot', 'alloy'])
+        self.assertEqual(sorted(trie.iter_substring_items('e')),
+                         [('aloe', 5), ('are', 6), ('ate', 7), ('be', 8)])
+        self.assertEqual(sorted(trie.iter_substring_values('nt')), [1])
+        self.assertEqual(list(trie.iter_substring_keys('x')), [])
+        self.assertEqual(sorted(trie.iter_substring_keys('')),
+                         sorted(self.words))
+
+    def test_substring_updates(self):
+        trie = self.trie
+        del trie['ant']
+        trie['pant'] = 10
+        trie['ant'] = 11
+        self.assertEqual(sorted(trie.iter_substring_keys('nt')),
+                         ['ant', 'pant'])
+        trie.pop('pant')
+        self.assertEqual(list(trie.iter_substring_keys('nt')), ['ant'])
+        clone = trie.copy()
+        clone['lent'] = 12
+        self.assertEqual(list(trie.iter_substring_keys('ent')), [])
+        self.assertEqual(list(clone.iter_substring_keys('ent')), ['lent'])
+        trie.clear()
+        self.assertEqual(list(trie.iter_substring_keys('a')), [])
+
+    def test_substring_random(self):
+        import random
+        rng = random.Random(0)
+        trie, items = SuffixStringTrie(), {}
+        for i in range(500):
+            key = ''.join(rng.choice('abc') for _ in range(rng.randint(0, 6)))
+            if key in items and rng.random() < 0.4:
+                del trie[key]
+                del items[key]
+            else:
+                trie[key] = items[key] = i
+        for _ in range(100):
+            substring = ''.join(rng.choice('abcd')
+                                for _ in range(rng.randint(1, 4)))
+            self.assertEqual(sorted(trie.iter_substring_keys(substring)),
+                             sorted(key for key in items if substring in key))
+
+
+class TestFrozenTrie(TestTrie):
+
+    def setUp(self):
+        super(TestFrozenTrie, self).setUp()
+        self.trie = self.trie.freeze()
+
+    def test_empty_string(self):
+        trie = SortedStringTrie(self.trie, **{'': '!'}).freeze()
+        self.assertEqual(trie.keys(''),
+                         ['', 'all', 'allot', 'alloy', 'aloe', 'an', 'ant',
+                          'are', 'ate', 'be'])
+        self.assertEqual(list(trie.iter_prefix_items('foo')), [('', '!')])
+        self.assertEqual(trie.longest_prefix_item('foo'), ('', '!'))
+
+    def test_len_count(self):
+        self.assertEqual(len(self.trie), 9)
+        self.assertEqual(self.trie.count(), 9)
+        self.assertEqual(self.trie.count('al'), 4)
+        self.assertEqual(self.trie.count('all'), 3)
+        self.assertEqual(self.trie.count('ann'), 0)
+        self.assertEqual(self.trie.count(''), 9)
+        self.assertEqual(self.trie.count('a'), 8)
+        self.assertEqual(self.trie.count('allot'), 1)
+        self.assertEqual(self.trie.count('x'), 0)
+
+    def test_immutable(self):
+        with self.assertRaises(TypeError):
+            self.trie['an'] = 1
+        with self.assertRaises(TypeError):
+            del self.trie['an']
+
+    def test_repr(self):
+        self.assertEqual(repr(StringTrie(b=1, a=0).freeze()),
+                         "FrozenTrie({'a': 0, 'b': 1})")
+
+    def test_tuple_keys(self):
+        from pytrie import FrozenTrie
+        trie = FrozenTrie({(1, 2): 'a', (1,): 'b', (3, None): 'c'})
+        self.assertEqual(trie[1, 2], 'a')
+        self.assertEqual(trie.longest_prefix_item((1, 2, 3)), ((1, 2), 'a'))
+        self.assertEqual(trie.keys((3,)), [(3, None)])
+        self.assertNotIn((3,), trie)
+
+
+class TestMmapTrie(TestFrozenTrie):
+
+    def setUp(self):
+        from pytrie import MmapTrie
+        super(TestMmapTrie, self).setUp()
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.trie.save(self.path)
+        self.trie = MmapTrie.open(self.path)
+
+    def tearDown(self):
+        self.trie.close()
+        os.remove(self.path)
+
+    def test_trie_save(self):
+        from pytrie import MmapTrie
+        trie = StringTrie(an=[0], ant=[1])
+        trie.save(self.path + '.2')
+        try:
+            with MmapTrie.open(self.path + '.2') as mapped:
+                self.assertEqual(mapped, trie)
+                self.assertEqual(mapped.longest_prefix_value('antonym'), [1])
+        finally:
+            os.remove(self.path + '.2')
+
+    def test_constructor(self):
+        from pytrie import MmapTrie
+        with MmapTrie(self.path) as mapped:
+            self.assertEqual(mapped, self.trie)
+
+    def test_empty(self):
+        from pytrie import MmapTrie
+        StringTrie().save(self.path)
+        with MmapTrie.open(self.path) as mapped:
+            self.assertEqual(len(mapped), 0)
+            self.assertEqual(mapped.items(), [])
+            self.assertRaises(KeyError, mapped.__getitem__, '')
+
+    def test_invalid_file(self):
+        from pytrie import MmapTrie
+        with open(self.path + '.2', 'wb') as f:
+            f.write(b'not a trie')
+        try:
+            with self.assertRaises(ValueError) as context:
+                MmapTrie.open(self.path + '.2')
+            self.assertIsNotNone(context.exception.__cause__)
+        finally:
+            os.remove(self.path + '.2')
+
+
+class TestCompressedTrie(WordsTrieMixin, unittest.TestCase):
+
+    type2test = CompressedStringTrie
+
+    def setUp(self):
+        super(TestCompressedTrie, self).setUp()
+        self.reference = StringTrie(self.trie)
+
+    def assertSameAsReference(self):
+        trie, reference = self.trie, self.reference
+        self.assertEqual(trie, reference)
+        self.assertEqual(len(trie), len(reference))
+        for key in 'a', 'al', 'all', 'allo', 'alloyed', 'an', 'b', 'c', '':
+            self.assertEqual(sorted(trie.items(key)),
+                             sorted(reference.items(key)))
+            self.assertEqual(trie.count(key), reference.count(key))
+            self.assertEqual(list(trie.iter_prefix_items(key)),
+                             list(reference.iter_prefix_items(key)))
+            self.assertEqual(trie.longest_prefix_item(key, None),
+                             reference.longest_prefix_item(key, None))
+
+    def test_compression(self):
+        root = self.trie._root
+        self.assertEqual(sorted(root.children), ['a', 'b'])
+        self.assertEqual(root.children['b'].label, 'be')
+        self.assertEqual(root.children['a'].children['l'].label, 'l')
+        self.assertEqual(
+            root.children['a'].children['l'].children['l'].children['o'].label,
+            'o')
+
+    def test_lookups(self):
+        self.assertSameAsReference()
+        self.assertEqual(self.trie.longest_prefix('alloyed'), 'alloy')
+        self.assertEqual(self.trie.longest_prefix_value('allo'), 2)
+        self.assertRaises(KeyError, self.trie.longest_prefix, 'alumni')
+        self.assertEqual(list(self.trie.iter_prefixes('antonym')),
+                         ['an', 'ant'])
+
+    def test_split_and_merge(self):
+        for key in 'al', 'alloyed', 'b', '':
+            self.trie[key] = self.reference[key] = key
+            self.assertSameAsReference()
+        for key in 'alloy', 'al', 'all', 'be', '', 'an':
+            del self.trie[key]
+            del self.reference[key]
+            self.assertSameAsReference()
+        self.assertRaises(KeyError, self.trie.__delitem__, 'allo')
+        self.assertEqual(self.trie._root.children['a'].children['l'].label,
+                         'l')
+
+    def test_pickle_copy(self):
+        from pickle import dumps, loads
+        self.assertEqual(loads(dumps(self.trie)), self.trie)
+        clone = self.trie.copy()
+        del clone['allot']
+        self.assertIn('allot', self.trie)